@@ -0,0 +1,191 @@
+"""
+Offline benchmarks for embed rendering and DASH manifest parsing
+
+Runs against the recorded fixtures in ``benchmark/fixtures`` without any network access.
+Run from the repository root (``config.json`` is loaded on import, like the bot)::
+
+    python -m benchmark --output benchmark/results.json
+    python -m benchmark --baseline benchmark/results.json
+
+With ``--baseline``, the exit status is 1 if any case got slower or allocates more than the tolerance allows.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from asyncpraw import Reddit
+from asyncpraw.models import Comment, Submission
+
+from command.author import Author, author_cache
+from command.awards import award_tiers
+from command.reddit import SubmissionType, get_reddit_embed, get_reddit_gallery_embed, get_reddit_poll_embed
+from command.snapshot import SubmissionSnapshot
+from command.video import get_urls_from_mpd
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+MPD_URL = "https://v.redd.it/2x9fk3m1lpq61/DASHPlaylist.mpd"
+
+
+def load_json(*path: str) -> Dict[str, Any]:
+    with open(os.path.join(FIXTURES, *path), "r") as file:
+        return json.load(file)
+
+
+def load_submission(reddit: Reddit, name: str) -> Submission:
+    return Submission(reddit, _data=load_json("submissions", f"{name}.json"))
+
+
+def run_coroutine(coroutine):
+    """Runs a coroutine that never suspends, without the overhead of an event loop"""
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    coroutine.close()
+    raise RuntimeError("Benchmark case suspended, a fixture is probably missing from a cache")
+
+
+def cases(reddit: Reddit) -> Dict[str, Callable[[], Any]]:
+    praw_submissions = {name.lower(): load_submission(reddit, name.lower()) for name in SubmissionType.__members__}
+    submissions = {name: SubmissionSnapshot.from_submission(s) for name, s in praw_submissions.items()}
+    comment = Comment(reddit, _data=load_json("comment.json"))
+    mpds = {}
+    for name in sorted(os.listdir(os.path.join(FIXTURES, "mpd"))):
+        with open(os.path.join(FIXTURES, "mpd", name), "r") as file:
+            mpds[os.path.splitext(name)[0]] = file.read()
+
+    benchmarks: Dict[str, Callable[[], Any]] = {}
+    for name, submission in submissions.items():
+        benchmarks[f"get_reddit_embed[{name}]"] = \
+            lambda s=submission: run_coroutine(get_reddit_embed(reddit, s))
+    benchmarks["get_reddit_poll_embed"] = lambda: run_coroutine(get_reddit_poll_embed(reddit, submissions["poll"]))
+    benchmarks["get_reddit_gallery_embed"] = \
+        lambda: run_coroutine(get_reddit_gallery_embed(reddit, submissions["gallery"]))
+    for name, submission in praw_submissions.items():
+        benchmarks[f"SubmissionSnapshot.from_submission[{name}]"] = \
+            lambda s=submission: SubmissionSnapshot.from_submission(s)
+    gallery = submissions["gallery"].to_dict()
+    benchmarks["SubmissionSnapshot.from_dict[gallery]"] = lambda: SubmissionSnapshot.from_dict(gallery)
+    benchmarks["award_tiers.render"] = lambda: award_tiers.render(comment.all_awardings)
+    for name, mpd in mpds.items():
+        benchmarks[f"get_urls_from_mpd[{name}]"] = lambda body=mpd: get_urls_from_mpd(MPD_URL, body)
+    return benchmarks
+
+
+def measure_time(function: Callable[[], Any], repeat: int, min_time: float) -> Dict[str, float]:
+    number = 1
+    while True:  # Calibrate the number of calls per round to last at least min_time
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        if time.perf_counter() - start >= min_time:
+            break
+        number *= 2
+    rounds: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        rounds.append((time.perf_counter() - start) / number)
+    best = min(rounds)
+    return {
+        "calls_per_round": number,
+        "best_seconds": best,
+        "median_seconds": statistics.median(rounds),
+        "ops_per_second": 1 / best,
+    }
+
+
+def measure_allocations(function: Callable[[], Any], calls: int) -> Dict[str, float]:
+    function()  # Warm up lazily built state so that it isn't counted
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(calls):
+            tracemalloc.clear_traces()
+            function()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        before = tracemalloc.take_snapshot()
+        for _ in range(calls):
+            function()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    return {
+        "peak_bytes": statistics.median(peaks),
+        "retained_bytes_per_call": sum(stat.size_diff for stat in diff) / calls,
+        "retained_blocks_per_call": sum(stat.count_diff for stat in diff) / calls,
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if result["ops_per_second"] < old["ops_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {old['ops_per_second']:,.0f} -> {result['ops_per_second']:,.0f} ops/s")
+        if result["peak_bytes"] > old["peak_bytes"] * (1 + tolerance) + 1024:
+            regressions.append(f"{name}: {old['peak_bytes']:,.0f} -> {result['peak_bytes']:,.0f} peak bytes")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Offline rendering benchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="timed rounds per case")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per round")
+    parser.add_argument("--allocation-calls", type=int, default=50, help="calls traced per case")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    reddit = Reddit(client_id="benchmark", client_secret="benchmark", user_agent="benchmark",
+                    check_for_updates=False)
+    # noinspection PyProtectedMember
+    author_cache._store("benchmark_author", "t2_bench01",
+                        Author(name="benchmark_author",
+                               icon_img="https://styles.redditmedia.com/t5_bench01/styles/profileIcon_x.png"))
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name, function in cases(reddit).items():
+        if args.filter not in name:
+            continue
+        results[name] = {**measure_time(function, args.repeat, args.min_time),
+                         **measure_allocations(function, args.allocation_calls)}
+        result = results[name]
+        print(f"{name:<40} {result['ops_per_second']:>12,.0f} ops/s {result['peak_bytes']:>10,.0f} B peak "
+              f"{result['retained_bytes_per_call']:>8,.0f} B retained")
+    asyncio.get_event_loop().run_until_complete(reddit.close())
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": time.time(),
+                "results": results,
+            }, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compare(results, json.load(file)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
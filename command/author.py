@@ -0,0 +1,142 @@
+import html
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional, Tuple
+
+from asyncpraw import Reddit
+from asyncpraw.models import Redditor
+from asyncprawcore.exceptions import Forbidden, NotFound, AsyncPrawcoreException
+
+from config import config
+from util import SharedStore, SingleFlight, TTLCache
+from .store import shared_store
+
+
+@dataclass(frozen=True)
+class Author:
+    """The parts of a redditor's profile used in embeds"""
+    name: str
+    icon_img: Optional[str]
+
+
+_MISSING = object()
+
+
+def _unescape(url: Optional[str]) -> Optional[str]:
+    return html.unescape(url) if url else None
+
+
+class AuthorCache:
+    """
+    Caches redditor profiles by name and by account fullname (t2_...)
+
+    Deleted and suspended accounts are cached as None for ``negative_ttl`` seconds.
+    With a shared store, profiles fetched by other processes are used before asking Reddit.
+    """
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float, batch: bool = True,
+                 store: Optional[SharedStore] = None):
+        self.profiles: TTLCache[Tuple[str, str], Optional[Author]] = TTLCache(max_size, ttl)
+        self.negative_ttl = negative_ttl
+        self.batch = batch
+        self.store = store
+        self.flights = SingleFlight()
+
+    def _store(self, name: Optional[str], fullname: Optional[str], author: Optional[Author]):
+        ttl = None if author is not None else self.negative_ttl
+        keys = []
+        if name is not None:
+            keys.append(("name", name.lower()))
+        if fullname is not None:
+            keys.append(("id", fullname))
+        for key in keys:
+            self.profiles.set(key, author, ttl)
+            if self.store is not None:
+                self.store.set("author", ":".join(key), asdict(author) if author else None,
+                               self.profiles.ttl if ttl is None else ttl)
+
+    def _cached(self, key: Tuple[str, str]):
+        """Profile from the local cache or the shared store, _MISSING if neither has it"""
+        author = self.profiles.get(key, _MISSING)
+        if author is _MISSING and self.store is not None:
+            data = self.store.get("author", ":".join(key), _MISSING)
+            if data is not _MISSING:
+                author = Author(**data) if data else None
+                self.profiles.set(key, author, None if author is not None else self.negative_ttl)
+        return author
+
+    async def get(self, reddit: Reddit, name: str, fullname: Optional[str] = None) -> Optional[Author]:
+        """
+        Returns the profile of a redditor, or None if the account is deleted or suspended
+
+        When the account fullname is known, the profile is resolved through the batch endpoint.
+        """
+        author = self._cached(("name", name.lower()))
+        if author is not _MISSING:
+            return author
+        if fullname is not None and self.batch:
+            return (await self.get_many(reddit, {fullname: name}))[fullname]
+        return await self.flights.do(("name", name.lower()), lambda: self._fetch(reddit, name))
+
+    async def _fetch(self, reddit: Reddit, name: str) -> Optional[Author]:
+        try:
+            redditor: Redditor = await reddit.redditor(name=name, fetch=True)
+        except (NotFound, Forbidden):
+            author = None
+        else:
+            author = None if getattr(redditor, "is_suspended", False) \
+                else Author(name=redditor.name, icon_img=_unescape(getattr(redditor, "icon_img", None)))
+        self._store(name, None, author)
+        return author
+
+    async def get_many(self, reddit: Reddit, names: Dict[str, str]) -> Dict[str, Optional[Author]]:
+        """
+        Resolves many redditors at once, given a mapping of account fullname to name
+
+        Uncached accounts are looked up with one ``/api/user_data_by_account_ids`` call,
+        falling back to one profile fetch per account if that endpoint is unavailable.
+
+        :return: A mapping of account fullname to profile
+        """
+        authors: Dict[str, Optional[Author]] = {}
+        missing: Dict[str, str] = {}
+        for fullname, name in names.items():
+            author = self._cached(("id", fullname))
+            if author is _MISSING:
+                missing[fullname] = name
+            else:
+                authors[fullname] = author
+        if missing:
+            key = ("batch", tuple(sorted(missing)))
+            authors.update(await self.flights.do(key, lambda: self._fetch_many(reddit, missing)))
+        return authors
+
+    async def _fetch_many(self, reddit: Reddit, names: Dict[str, str]) -> Dict[str, Optional[Author]]:
+        try:
+            user_data = await reddit.request("GET", "/api/user_data_by_account_ids",
+                                             params={"ids": ",".join(names)})
+        except AsyncPrawcoreException:
+            user_data = None
+        if not isinstance(user_data, dict):
+            authors = {}
+            for fullname, name in names.items():
+                authors[fullname] = await self.get(reddit, name)
+                self._store(None, fullname, authors[fullname])
+            return authors
+
+        authors = {}
+        for fullname, name in names.items():
+            data = user_data.get(fullname)
+            author = Author(name=data["name"], icon_img=_unescape(data.get("profile_img"))) if data else None
+            self._store(name, fullname, author)
+            authors[fullname] = author
+        return authors
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.profiles.hits,
+            "misses": self.profiles.misses,
+            "entries": len(self.profiles),
+        }
+
+
+author_cache = AuthorCache(config.authors.max_size, config.authors.ttl, config.authors.negative_ttl,
+                           config.authors.batch, shared_store)
@@ -0,0 +1,41 @@
+import bisect
+from typing import Any, Dict, Iterable, List, Mapping
+
+from config import config, AwardTier
+
+
+class AwardTiers:
+    """
+    Sorts awards into tiers and renders the count of each tier
+
+    Awards are looked up by id first. Awards not listed in any tier fall in the tier with the highest
+    ``min_coin_price`` at or below their coin price. That tier is found again every time rather than remembered,
+    since there is no bound to the award ids Reddit can send.
+    """
+    def __init__(self, tiers: List[AwardTier]):
+        self.emojis = [tier.emoji for tier in tiers]
+        self._by_id: Dict[str, int] = {
+            award_id: index for index, tier in enumerate(tiers) for award_id in tier.award_ids
+        }
+        by_price = sorted((tier.min_coin_price, index) for index, tier in enumerate(tiers))
+        self._prices = [price for price, _ in by_price]
+        self._price_tiers = [index for _, index in by_price]
+
+    def tier(self, award: Mapping[str, Any]) -> int:
+        """Index of the tier of an award, -1 if it is below every tier"""
+        index = self._by_id.get(award.get("id"))
+        if index is None:
+            position = bisect.bisect_right(self._prices, award["coin_price"]) - 1
+            index = self._price_tiers[position] if position >= 0 else -1
+        return index
+
+    def render(self, awardings: Iterable[Mapping[str, Any]]) -> str:
+        counts = [0] * len(self.emojis)
+        for award in awardings:
+            index = self.tier(award)
+            if index >= 0:
+                counts[index] += award["count"]
+        return "".join(f"{emoji}{count:,}" for emoji, count in zip(self.emojis, counts) if count > 0)
+
+
+award_tiers = AwardTiers(config.awards.tiers)
@@ -0,0 +1,199 @@
+"""
+Video download and muxing in a separate process, reached over a unix socket
+
+Run standalone from the repository root with ``python -m command.media_worker <socket path>``,
+or let main.py start ``media_workers.processes`` of them.
+"""
+import asyncio
+import json
+import logging
+import os
+import struct
+import subprocess
+import sys
+from asyncio import Semaphore, StreamReader, StreamWriter
+from dataclasses import asdict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from aiohttp import ClientSession
+
+from config import config, Config
+from util import create_http_session, remove_file
+from .snapshot import VideoSnapshot
+from .video import download_reddit_video_here
+
+_HEADER = struct.Struct("!II")  # JSON length, payload length
+
+
+async def write_frame(writer: StreamWriter, message: Dict[str, Any], payload: bytes = b""):
+    body = json.dumps(message).encode()
+    writer.write(_HEADER.pack(len(body), len(payload)) + body)
+    if payload:
+        writer.write(payload)
+    await writer.drain()
+
+
+async def read_frame(reader: StreamReader) -> Tuple[Dict[str, Any], bytes]:
+    """:raises asyncio.IncompleteReadError: if the connection closes first"""
+    size, payload_size = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    message = json.loads(await reader.readexactly(size))
+    return message, await reader.readexactly(payload_size) if payload_size else b""
+
+
+class MediaWorkerError(Exception):
+    """Raised when a media worker fails a job or doesn't finish it in time"""
+
+
+class _JobSubmission(NamedTuple):
+    """The parts of a submission snapshot the video pipeline uses"""
+    id: str
+    video: VideoSnapshot
+
+
+class _JobBot:
+    """The parts of MyBot the video pipeline uses, for one job"""
+    def __init__(self, worker: "MediaWorker", headers: Dict[str, str]):
+        self.config = worker.config
+        self.http_session = worker.http_session
+        self.ffmpeg_semaphore = worker.ffmpeg_semaphore
+        self._headers = headers
+
+    def reddit_headers(self) -> Dict[str, str]:
+        return self._headers
+
+
+class MediaWorker:
+    """Serves video jobs on a unix socket, one request and response frame at a time per connection"""
+    def __init__(self, config_: Config):
+        self.config = config_
+        self.ffmpeg_semaphore = Semaphore(config_.video.ffmpeg_workers)
+        self._http_session: Optional[ClientSession] = None
+
+    @property
+    def http_session(self) -> ClientSession:
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = create_http_session(self.config)
+        return self._http_session
+
+    async def serve(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        remove_file(path)
+        server = await asyncio.start_unix_server(self._handle, path)
+        parent = os.getppid()
+        try:
+            async with server:
+                # Exits once the parent process is gone, even if it couldn't stop this one
+                while os.getppid() == parent:
+                    await asyncio.sleep(1)
+        finally:
+            remove_file(path)
+            if self._http_session is not None:
+                await self._http_session.close()
+
+    async def _handle(self, reader: StreamReader, writer: StreamWriter):
+        try:
+            while True:
+                try:
+                    request, _ = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    return
+                response, payload = await self._run(request)
+                await write_frame(writer, response, payload)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _run(self, request: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        if request.get("op") == "ping":
+            return {"ok": True}, b""
+        rendition_url: Optional[str] = None
+
+        async def on_result(url: str, _: bytes):  # The bot caches the result, only the rendition is sent back
+            nonlocal rendition_url
+            rendition_url = url
+        try:
+            submission = _JobSubmission(request["id"], VideoSnapshot(**request["video"]))
+            data = await download_reddit_video_here(_JobBot(self, request["headers"]), submission, request["limit"],
+                                                    on_result)
+        except Exception as e:
+            logging.getLogger(__name__).exception("Video job %s failed", request.get("id"))
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}, b""
+        return {"ok": True, "rendition_url": rendition_url if data is not None else None}, data or b""
+
+
+class MediaWorkerClient:
+    """
+    Sends video jobs to media workers, preferring the one with the fewest jobs in flight
+
+    Jobs are only retried on another worker if they could not be sent.
+    """
+    def __init__(self, sockets: List[str], timeout: float):
+        self.sockets = list(sockets)
+        self.timeout = timeout
+        self._in_flight = {path: 0 for path in self.sockets}
+
+    async def download(self, submission, headers: Dict[str, str], limit: int) -> Optional[Tuple[bytes, str]]:
+        """
+        Has a worker download and mux a Reddit video that fits in ``limit`` bytes
+
+        :return: The muxed video and the url of the rendition used, or None if it doesn't fit
+        :raises MediaWorkerError: if the job failed or timed out
+        :raises ConnectionError: if no worker could be reached
+        """
+        request = {"op": "video", "id": submission.id, "video": asdict(submission.video), "headers": headers,
+                   "limit": limit}
+        for path in sorted(self.sockets, key=self._in_flight.__getitem__):
+            try:
+                reader, writer = await asyncio.open_unix_connection(path)
+            except OSError:
+                continue
+            self._in_flight[path] += 1
+            try:
+                await write_frame(writer, request)
+                response, payload = await asyncio.wait_for(read_frame(reader), self.timeout)
+            except asyncio.TimeoutError:
+                raise MediaWorkerError(f"Video job {submission.id} timed out after {self.timeout}s")
+            except (OSError, asyncio.IncompleteReadError):
+                continue
+            finally:
+                self._in_flight[path] -= 1
+                writer.close()
+            if not response.get("ok"):
+                raise MediaWorkerError(f"Video job {submission.id} failed: {response.get('error')}")
+            if not payload:
+                return None
+            return payload, response["rendition_url"]
+        raise ConnectionError("No media worker could be reached")
+
+
+def spawn_workers(count: int, socket_dir: str) -> Tuple[List[subprocess.Popen], List[str]]:
+    """Starts media worker processes and returns them with their socket paths"""
+    sockets = [os.path.abspath(os.path.join(socket_dir, f"worker-{os.getpid()}-{index}.sock"))
+               for index in range(count)]
+    processes = [subprocess.Popen([sys.executable, "-m", "command.media_worker", path]) for path in sockets]
+    return processes, sockets
+
+
+def stop_workers(processes: List[subprocess.Popen], timeout: float = 5.0):
+    """Terminates media worker processes and waits for them to exit, killing the ones that take too long"""
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python -m command.media_worker <socket path>")
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.get_event_loop().run_until_complete(MediaWorker(config).serve(sys.argv[1]))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Dict
+
+from asyncpraw import Reddit
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+request_priority: ContextVar[Priority] = ContextVar("request_priority", default=Priority.INTERACTIVE)
+"""Priority of the Reddit API calls made by the current task"""
+
+
+class RedditRateLimiter:
+    """
+    Spaces Reddit API calls with a token bucket sized from Reddit's rate limit headers
+
+    It wraps the rate limiter of an asyncpraw session, which parses X-Ratelimit-Remaining and
+    X-Ratelimit-Reset after every response. Interactive calls go right away while more than ``reserve`` calls
+    are left after the ones in flight, as they would without the limiter. Past that, and for background calls
+    (see ``request_priority``) at all times, the bucket refills at the remaining budget spread over the
+    time left until the reset. Once only ``reserve`` calls are left, background calls wait for the reset,
+    and they always let waiting interactive calls go first.
+    """
+    def __init__(self, inner, rate: float, burst: int, reserve: int):
+        self._inner = inner
+        self.rate = self.default_rate = rate
+        self.burst = burst
+        self.reserve = reserve
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._interactive_waiting = 0
+        self._in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    @classmethod
+    def install(cls, reddit: Reddit, rate: float, burst: int, reserve: int) -> "RedditRateLimiter":
+        """Puts a limiter in front of every API call the Reddit instance makes"""
+        # noinspection PyProtectedMember
+        session = reddit._core
+        limiter = cls(session._rate_limiter, rate, burst, reserve)
+        session._rate_limiter = limiter
+        return limiter
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    @property
+    def remaining(self) -> float:
+        return self._inner.remaining if self._inner.remaining is not None else float("inf")
+
+    @property
+    def seconds_to_reset(self) -> float:
+        reset = self._inner.reset_timestamp
+        return max(reset - time.time(), 0.0) if reset is not None else 0.0
+
+    def _refill(self):
+        if self._inner.reset_timestamp is not None and self.seconds_to_reset <= 0:
+            self.rate = self.default_rate  # A new window started, the last budget no longer applies
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _delay(self, priority: Priority) -> float:
+        """Seconds to wait before a call of this priority may go, 0 if it may go now"""
+        if priority is Priority.INTERACTIVE and self.remaining - self._in_flight > self.reserve:
+            return 0.0
+        if priority is Priority.BACKGROUND:
+            if self.remaining <= self.reserve and self.seconds_to_reset > 0:
+                return self.seconds_to_reset
+            if self._interactive_waiting:
+                return 1 / self.rate
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        return 0.0
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE):
+        start = time.monotonic()
+        if priority is Priority.INTERACTIVE:
+            self._interactive_waiting += 1
+        try:
+            while True:
+                self._refill()
+                delay = self._delay(priority)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+        finally:
+            if priority is Priority.INTERACTIVE:
+                self._interactive_waiting -= 1
+        self._tokens = max(self._tokens - 1, 0.0)  # Calls let through unpaced don't build up a debt
+        self.calls += 1
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            self.throttled += 1
+            self.wait_seconds += waited
+
+    def _adapt(self):
+        remaining, seconds_to_reset = self._inner.remaining, self.seconds_to_reset
+        if remaining is not None and seconds_to_reset > 0:
+            self.rate = max(remaining / seconds_to_reset, 0.01)
+
+    async def call(self, request_function, set_header_callback, *args, **kwargs):
+        await self.acquire(request_priority.get())
+        self._in_flight += 1
+        try:
+            return await self._inner.call(request_function, set_header_callback, *args, **kwargs)
+        finally:
+            self._in_flight -= 1
+            self._adapt()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "remaining": self.remaining,
+            "seconds_to_reset": self.seconds_to_reset,
+            "rate": self.rate,
+            "calls": self.calls,
+            "throttled": self.throttled,
+            "wait_seconds": self.wait_seconds,
+        }
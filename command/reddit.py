@@ -1,56 +1,98 @@
+import asyncio
 import datetime
-from enum import Enum, auto
-from typing import Tuple, Union, List
-from urllib.parse import urlparse
+from typing import Tuple, Union, List, Optional, Callable, Awaitable, Dict
 
 from asyncpraw import Reddit
-from asyncpraw.models import Submission, Redditor, PollData, PollOption
+from asyncpraw.models import Submission
 from asyncpraw.reddit import Comment
 from discord import Embed, Color
 from discord.embeds import EmptyEmbed
 
+from config import config
 from util import *
+from .author import Author, author_cache
+from .awards import award_tiers
+from .snapshot import PollOptionSnapshot, PollSnapshot, SubmissionSnapshot, SubmissionType
+from .store import shared_store
+from .submission_cache import SubmissionCache
+from .url import RedditKey
 
 
-class SubmissionType(Enum):
-    SELF = auto()
-    POLL = auto()
-    LINK = auto()
-    IMAGE = auto()
-    VIDEO = auto()
-    GALLERY = auto()
-
-    @classmethod
-    def get_submission_type(cls, submission: Submission):
-        if submission.is_self:
-            if hasattr(submission, "poll_data"):
-                return cls.POLL
-            return cls.SELF
-        else:
-            if hasattr(submission, "post_hint") and submission.post_hint == "image":
-                return cls.IMAGE
-            elif hasattr(submission, "post_hint") and submission.post_hint == "hosted:video":
-                return cls.VIDEO
-            elif hasattr(submission, "is_gallery") and submission.is_gallery is True:
-                return cls.GALLERY
-            return cls.LINK
-
-    @classmethod
-    def type_is_self(cls, submission_type: "SubmissionType"):
-        return submission_type is cls.SELF or submission_type is cls.POLL
-
-    def is_self(self):
-        return SubmissionType.type_is_self(self)
-
-
-async def get_reddit_embed(reddit: Reddit, submission: Submission) -> Tuple[str, Embed]:
+_submission_flights = SingleFlight()
+submission_cache = SubmissionCache(config.submissions.max_size, config.submissions.ttl,
+                                   config.submissions.volatile_ttl, shared_store)
+
+
+async def fetch_submission(reddit: Reddit, key: RedditKey) -> SubmissionSnapshot:
+    """
+    Fetches a submission through the submission cache, as a snapshot
+
+    Concurrent callers for the same post share one request.
+    """
+    async def fetch():
+        submission: Submission = await reddit.submission(id=key.id)
+        return SubmissionSnapshot.from_submission(submission)
+    return await submission_cache.get(key, lambda: _submission_flights.do(key, fetch))
+
+
+async def fetch_comment(reddit: Reddit, key: RedditKey) -> Comment:
+    """Fetches a comment with its replies"""
+    comment: Comment = await reddit.comment(id=key.id)
+    await comment.refresh()
+    return comment
+
+
+def _type_label(item: Union[SubmissionSnapshot, Comment]) -> str:
+    """Value of the submission_type metrics label for a submission or comment"""
+    submission_type: Optional[SubmissionType] = getattr(item, "submission_type", None)
+    return submission_type.name.lower() if submission_type is not None else "comment"
+
+
+async def get_author(reddit: Reddit, item: Union[SubmissionSnapshot, Comment]) -> Tuple[str, Optional[Author]]:
+    """Returns the author name of a submission or comment and their cached profile, if available"""
+    if item.author is None:
+        return "[deleted]", None
+    name = str(item.author)
+    with stage("author", _type_label(item)):
+        author = await author_cache.get(reddit, name, getattr(item, "author_fullname", None))
+    return (author.name if author else name), author
+
+
+SubmissionRenderer = Callable[[Reddit, SubmissionSnapshot], Awaitable[Optional[Embed]]]
+_renderers: Dict[SubmissionType, List[SubmissionRenderer]] = {}
+
+
+def submission_renderer(*submission_types: SubmissionType):
+    """Registers a function that renders an extra embed for the given submission types"""
+    def decorator(renderer: SubmissionRenderer) -> SubmissionRenderer:
+        for submission_type in submission_types:
+            _renderers.setdefault(submission_type, []).append(renderer)
+        return renderer
+    return decorator
+
+
+async def render_submission(reddit: Reddit, submission: SubmissionSnapshot) -> Tuple[str, List[Embed]]:
+    """
+    Renders the main embed of a submission followed by the extra embeds for its type
+
+    Only the renderers registered for the submission's type are run, concurrently with the main embed.
+    """
+    with stage("embed", _type_label(submission)):
+        (content, embed), *extra_embeds = await asyncio.gather(
+            get_reddit_embed(reddit, submission),
+            *(renderer(reddit, submission) for renderer in _renderers.get(submission.submission_type, ())),
+        )
+    return content, [embed, *(e for e in extra_embeds if e is not None)]
+
+
+async def get_reddit_embed(reddit: Reddit, submission: SubmissionSnapshot) -> Tuple[str, Embed]:
     """
     Takes a reddit url and turns it into a discord embed
 
     :raises util.error.CommandUseFailure
     """
     submission_type: SubmissionType = submission.submission_type
-    author: Redditor = await reddit.redditor(name=submission.author, fetch=True)
+    author_name, author = await get_author(reddit, submission)
     safe_url = f"https://www.reddit.com{submission.permalink}"
 
     content = f"<{safe_url}>"
@@ -63,9 +105,9 @@ async def get_reddit_embed(reddit: Reddit, submission: Submission) -> Tuple[str,
         color=Color.from_rgb(255, 69, 0),
         timestamp=datetime.datetime.utcfromtimestamp(submission.created_utc),
     ).set_author(
-        name=f"/u/{author.name}",
-        url=f"https://www.reddit.com/u/{author.name}",
-        icon_url=author.icon_img if hasattr(author, "icon_img") else EmptyEmbed
+        name=f"/u/{author_name}",
+        url=f"https://www.reddit.com/u/{author_name}",
+        icon_url=author.icon_img if author and author.icon_img else EmptyEmbed
     ).add_field(
         name="Score",
         value=f"{submission.score:,}",
@@ -79,7 +121,7 @@ async def get_reddit_embed(reddit: Reddit, submission: Submission) -> Tuple[str,
         icon_url="https://www.redditstatic.com/desktop2x/img/favicon/favicon-96x96.png",
     ).set_thumbnail(
         url=submission.thumbnail
-        if hasattr(submission, "thumbnail")
+        if submission.thumbnail is not None
         and submission.thumbnail != "default"
         and submission_type is not SubmissionType.IMAGE
         and submission_type is not SubmissionType.VIDEO
@@ -88,11 +130,10 @@ async def get_reddit_embed(reddit: Reddit, submission: Submission) -> Tuple[str,
     ).set_image(
         url=submission.url if submission_type is SubmissionType.IMAGE else EmptyEmbed
     )
-    awards = get_reddit_awards(submission)
-    if awards:
+    if submission.awards:
         embed.add_field(
             name="Awards",
-            value=awards,
+            value=submission.awards,
             inline=True,
         )
 
@@ -101,7 +142,7 @@ async def get_reddit_embed(reddit: Reddit, submission: Submission) -> Tuple[str,
 
 async def get_reddit_comment_embed(reddit: Reddit, comment: Comment) -> Tuple[str, Embed]:
     """Takes a reddit comment url and turns it into a discord embed"""
-    author: Redditor = await reddit.redditor(name=comment.author.name, fetch=True)
+    author_name, author = await get_author(reddit, comment)
     safe_url = f"https://www.reddit.com{comment.permalink}"
 
     content = f"<{safe_url}>"
@@ -112,9 +153,9 @@ async def get_reddit_comment_embed(reddit: Reddit, comment: Comment) -> Tuple[st
         color=Color.from_rgb(255, 69, 0),
         timestamp=datetime.datetime.utcfromtimestamp(comment.created_utc),
     ).set_author(
-        name=f"/u/{author.name}",
-        url=f"https://www.reddit.com/u/{author.name}",
-        icon_url=author.icon_img if hasattr(author, "icon_img") else EmptyEmbed
+        name=f"/u/{author_name}",
+        url=f"https://www.reddit.com/u/{author_name}",
+        icon_url=author.icon_img if author and author.icon_img else EmptyEmbed
     ).add_field(
         name="Score",
         value=f"{comment.score:,}",
@@ -127,7 +168,7 @@ async def get_reddit_comment_embed(reddit: Reddit, comment: Comment) -> Tuple[st
         text=f"Reddit - /r/{comment.subreddit}",
         icon_url="https://www.redditstatic.com/desktop2x/img/favicon/favicon-96x96.png",
     )
-    awards = get_reddit_awards(comment)
+    awards = award_tiers.render(comment.all_awardings)
     if awards:
         embed.add_field(
             name="Awards",
@@ -138,37 +179,14 @@ async def get_reddit_comment_embed(reddit: Reddit, comment: Comment) -> Tuple[st
     return content, embed
 
 
-BRONZE_RANGE = interval(None, 100, incl_end=False)
-SILVER_RANGE = interval(100, 500, incl_end=False)
-GOLD_RANGE = interval(500, 1800, incl_end=False)
-PLATINUM_RANGE = interval(1800, None)
-
-
-def get_reddit_awards(submission: Union[Submission, Comment]) -> str:
-    awards = [0, 0, 0, 0]  # platinum, gold, silver, bronze
-    for award in submission.all_awardings:
-        for award_index, award_type in enumerate((PLATINUM_RANGE, GOLD_RANGE, SILVER_RANGE, BRONZE_RANGE)):
-            if award["coin_price"] in award_type:
-                awards[award_index] += award["count"]
-                break
-    return "".join(
-        f"{emoji}{awards[award_index]:,}"
-        for award_index, emoji in enumerate((":medal:", ":first_place:", ":second_place:", ":third_place:"))
-        if awards[award_index] > 0
-    )
-
-
-async def get_reddit_poll_embed(reddit: Reddit, submission: Submission) -> Union[Embed, None]:
+@submission_renderer(SubmissionType.POLL)
+async def get_reddit_poll_embed(reddit: Reddit, submission: SubmissionSnapshot) -> Union[Embed, None]:
     if submission.submission_type is not SubmissionType.POLL:
         return None
-    poll_data: PollData = submission.poll_data
-    total_vote_count: int
-    voting_end_timestamp: float
-    options: List[PollOption]
-    # noinspection PyUnresolvedReferences
-    total_vote_count, voting_end_timestamp, options = (poll_data.total_vote_count,
-                                                       poll_data.voting_end_timestamp / 1000.0,
-                                                       poll_data.options)
+    poll: PollSnapshot = submission.poll
+    total_vote_count, voting_end_timestamp, options = (poll.total_vote_count,
+                                                       poll.voting_end_timestamp,
+                                                       poll.options)
 
     voting_end = datetime.datetime.fromtimestamp(voting_end_timestamp, datetime.timezone.utc)
     poll_active: bool = datetime.datetime.now(datetime.timezone.utc) < voting_end
@@ -188,11 +206,8 @@ async def get_reddit_poll_embed(reddit: Reddit, submission: Submission) -> Union
 
     poll_option_bar_fill = ["\U0001F7E5", "\U0001F7E6", "\U0001F7E9", "\U0001F7E8", "\U0001F7EA", "\U0001F7E7"]
     for i in range(len(options)):
-        option: PollOption = options[i]
-        vote_count: int
-        text: str
-        # noinspection PyUnresolvedReferences
-        vote_count, text = (option.vote_count, option.text)
+        option: PollOptionSnapshot = options[i]
+        vote_count, text = (option.vote_count or 0, option.text)
         percentage: int = round(float(vote_count)/float(total_vote_count) * 100.0) if total_vote_count != 0 else 0
         option_bar = get_poll_option_bar(percentage, poll_option_bar_fill[i], "\u2B1B")
         embed.add_field(name=text,
@@ -208,11 +223,10 @@ def get_poll_option_bar(percentage: int, bar_left: str, bar_right: str) -> str:
     return (str(bar_left) * num_left) + (str(bar_right) * num_right)
 
 
-async def get_reddit_gallery_embed(reddit: Reddit, submission: Submission) -> Union[Embed, None]:
+@submission_renderer(SubmissionType.GALLERY)
+async def get_reddit_gallery_embed(reddit: Reddit, submission: SubmissionSnapshot) -> Union[Embed, None]:
     if submission.submission_type is not SubmissionType.GALLERY:
         return None
-    gallery_data = submission.gallery_data
-    media_metadata = submission.media_metadata
     embed: Embed = Embed(
         title="Image Gallery",
         url=f"https://www.reddit.com/gallery/{submission.id}",
@@ -227,14 +241,11 @@ async def get_reddit_gallery_embed(reddit: Reddit, submission: Submission) -> Un
 
     def image_link(i: int) -> str:
         # Get text for link
-        return f"[{digits[min(i, 19)]}]" \
-               f"(https://i.redd.it{urlparse(media_metadata[gallery_data['items'][i]['media_id']]['s']['u']).path})"
-        # Get media id from gallery_data, then dig into media_metadata[id], then extract the id.png part of the url
+        return f"[{digits[min(i, 19)]}]({submission.gallery_urls[i]})"
 
     # Use this to test emojis for a gallery of 21 images
-    # for i in range(len(gallery_data['items']), 21):
-    #     gallery_data['items'].append(gallery_data['items'][len(gallery_data['items'])-1])
-    links: List[str] = list(map(image_link, range(0, len(gallery_data['items']))))
+    # submission = dataclasses.replace(submission, gallery_urls=submission.gallery_urls * 21)
+    links: List[str] = list(map(image_link, range(0, len(submission.gallery_urls))))
     links_row_1 = " ".join(links[0:5])
     links_row_2 = " ".join(links[5:10])
     links_row_3 = " ".join(links[10:15])
@@ -245,10 +256,11 @@ async def get_reddit_gallery_embed(reddit: Reddit, submission: Submission) -> Un
     return embed
 
 
-async def get_reddit_video_embed(reddit: Reddit, submission: Submission) -> Union[Embed, None]:
-    if submission.submission_type is not SubmissionType.VIDEO:
+@submission_renderer(SubmissionType.VIDEO)
+async def get_reddit_video_embed(reddit: Reddit, submission: SubmissionSnapshot) -> Union[Embed, None]:
+    if submission.submission_type is not SubmissionType.VIDEO or submission.video is None:
         return None
-    duration = submission.media["reddit_video"]["duration"]
+    duration = submission.video.duration
     hours, remainder = divmod(duration, 3600)
     minutes, seconds = divmod(remainder, 60)
     embed: Embed = Embed(
@@ -262,38 +274,31 @@ async def get_reddit_video_embed(reddit: Reddit, submission: Submission) -> Unio
               ) + f":{seconds:02}"
     ).set_thumbnail(
         url=submission.thumbnail
-        if hasattr(submission, "thumbnail")
+        if submission.thumbnail is not None
         and submission.thumbnail != "default"
         else EmptyEmbed
     )
     return embed
 
 
-def request_info_gallery(reddit: Reddit, submission: Submission) -> Union[str, None]:
+def request_info_gallery(reddit: Reddit, submission: SubmissionSnapshot) -> Union[str, None]:
     if submission.submission_type is not SubmissionType.GALLERY:
         return None
-    gallery_data = submission.gallery_data
-    media_metadata = submission.media_metadata
-
     def image_link(i: int) -> str:
         num = i+1
         return f"**{num}**\n" \
-               f"https://i.redd.it{urlparse(media_metadata[gallery_data['items'][i]['media_id']]['s']['u']).path}"
+               f"{submission.gallery_urls[i]}"
 
-    return "\n".join(map(image_link, range(0, len(gallery_data['items']))))
+    return "\n".join(map(image_link, range(0, len(submission.gallery_urls))))
 
 
-def request_info_poll(reddit: Reddit, submission: Submission) -> Union[str, None]:
+def request_info_poll(reddit: Reddit, submission: SubmissionSnapshot) -> Union[str, None]:
     if submission.submission_type is not SubmissionType.POLL:
         return None
-    poll_data: PollData = submission.poll_data
-    total_vote_count: int
-    voting_end_timestamp: float
-    options: List[PollOption]
-    # noinspection PyUnresolvedReferences
-    total_vote_count, voting_end_timestamp, options = (poll_data.total_vote_count,
-                                                       poll_data.voting_end_timestamp / 1000.0,
-                                                       poll_data.options)
+    poll: PollSnapshot = submission.poll
+    total_vote_count, voting_end_timestamp, options = (poll.total_vote_count,
+                                                       poll.voting_end_timestamp,
+                                                       poll.options)
 
     voting_end = datetime.datetime.fromtimestamp(voting_end_timestamp, datetime.timezone.utc)
     poll_active: bool = datetime.datetime.now(datetime.timezone.utc) < voting_end
@@ -304,11 +309,8 @@ def request_info_poll(reddit: Reddit, submission: Submission) -> Union[str, None
     options_texts: List[str] = []
     poll_option_bar_fill = ["\U0001F7E5", "\U0001F7E6", "\U0001F7E9", "\U0001F7E8", "\U0001F7EA", "\U0001F7E7"]
     for i in range(len(options)):
-        option: PollOption = options[i]
-        vote_count: int
-        text: str
-        # noinspection PyUnresolvedReferences
-        vote_count, text = (option.vote_count, option.text)
+        option: PollOptionSnapshot = options[i]
+        vote_count, text = (option.vote_count or 0, option.text)
         percentage: int = round(float(vote_count) / float(total_vote_count) * 100.0) if total_vote_count != 0 else 0
         option_bar = get_poll_option_bar(percentage, poll_option_bar_fill[i], "\u2B1B")
         options_texts.append(
@@ -0,0 +1,164 @@
+import asyncio
+import bisect
+import itertools
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Hashable, List, Optional, Tuple
+
+from util.error import CommandUseFailure
+
+
+@dataclass
+class _Job:
+    function: Callable[[], Awaitable[None]]
+    on_position: Optional[Callable[[int], Awaitable[None]]]
+    future: asyncio.Future
+    position: int = 0  # Last place in the queue reported through on_position, 0 if never reported
+    reporter: Optional[asyncio.Task] = None
+
+
+class VideoScheduler:
+    """
+    Runs video jobs on a fixed number of workers, taking turns between guilds
+
+    Jobs of one guild run by priority, then in the order they were submitted.
+    Guilds are served round robin so that a burst of videos in one guild doesn't starve the others.
+    Queued jobs are told their place in the queue whenever it changes, at most once every ``REPORT_INTERVAL``
+    seconds per job, so that a burst of jobs doesn't cost a message edit per job every time the queue moves.
+    """
+    REPORT_INTERVAL = 2.0
+
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._queues: "OrderedDict[Hashable, List[Tuple[int, int, _Job]]]" = OrderedDict()
+        self._counter = itertools.count()
+        self._queued = 0
+        self._busy = 0
+        self._ready: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        return self._busy
+
+    def submit(self, guild_id: Hashable, function: Callable[[], Awaitable[None]],
+               on_position: Optional[Callable[[int], Awaitable[None]]] = None, priority: int = 0) -> asyncio.Future:
+        """
+        Queues a job and returns a future for its result
+
+        :raises util.error.CommandUseFailure: if the queue is full
+        """
+        if self._queued >= self.max_queued:
+            raise CommandUseFailure("Too many videos are waiting to be uploaded, try again later")
+        if not self._workers:
+            self._start()
+        job = _Job(function=function, on_position=on_position, future=asyncio.get_event_loop().create_future())
+        bisect.insort(self._queues.setdefault(guild_id, []), (-priority, next(self._counter), job))
+        self._queued += 1
+        self._ready.set()
+        self._report_positions()
+        return job.future
+
+    def _start(self):
+        self._ready = asyncio.Event()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for queue in self._queues.values():
+            for _, _, job in queue:
+                job.future.cancel()
+        self._queues.clear()
+        self._queued = 0
+
+    def _order(self) -> List[_Job]:
+        """Queued jobs in the order they will run"""
+        queues = [[job for _, _, job in queue] for queue in self._queues.values()]
+        return [job for round_ in itertools.zip_longest(*queues) for job in round_ if job is not None]
+
+    def _report_positions(self):
+        for position, job in enumerate(self._order(), start=1):
+            # Jobs that a free worker is about to pick up aren't worth reporting
+            if job.position != position and (job.position or position > self.workers - self._busy):
+                self._report(job, position)
+
+    def _report(self, job: _Job, position: int):
+        job.position = position
+        if job.on_position is None:
+            return
+        if position == 0 and job.reporter is not None:
+            job.reporter.cancel()  # The job is starting, which is reported right away
+            job.reporter = None
+        if job.reporter is None or job.reporter.done():
+            job.reporter = asyncio.ensure_future(self._report_latest(job))
+            job.reporter.add_done_callback(_log_report_failure)
+
+    async def _report_latest(self, job: _Job):
+        """Reports the place of a job, then its latest place every REPORT_INTERVAL seconds until it stops changing"""
+        while True:
+            reported = job.position
+            await job.on_position(reported)
+            if reported == 0:
+                return
+            await asyncio.sleep(self.REPORT_INTERVAL)
+            if job.position == reported:
+                return
+
+    def _pop(self) -> Optional[_Job]:
+        if not self._queues:
+            return None
+        guild_id, queue = next(iter(self._queues.items()))
+        _, _, job = queue.pop(0)
+        del self._queues[guild_id]
+        if queue:
+            self._queues[guild_id] = queue  # Back of the line
+        self._queued -= 1
+        return job
+
+    async def _work(self):
+        while True:
+            job = self._pop()
+            if job is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            self._busy += 1
+            try:
+                self._report_positions()
+                if not job.future.cancelled():
+                    await self._run(job)
+            finally:
+                self._busy -= 1
+
+    async def _run(self, job: _Job):
+        if job.position:
+            self._report(job, 0)
+        task = asyncio.ensure_future(job.function())
+        try:
+            # Shielded so that a job cancelled from within can be told apart from this worker being cancelled
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            if not task.done():  # The worker itself is being cancelled
+                task.cancel()
+                raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+def _log_report_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.getLogger(__name__).warning("Could not report a place in the video queue", exc_info=task.exception())
@@ -0,0 +1,161 @@
+from dataclasses import asdict, dataclass
+from enum import Enum, auto
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import dacite
+from asyncpraw.models import Submission
+
+from .awards import award_tiers
+
+
+class SubmissionType(Enum):
+    SELF = auto()
+    POLL = auto()
+    LINK = auto()
+    IMAGE = auto()
+    VIDEO = auto()
+    GALLERY = auto()
+
+    @classmethod
+    def get_submission_type(cls, submission: Submission):
+        if submission.is_self:
+            if hasattr(submission, "poll_data"):
+                return cls.POLL
+            return cls.SELF
+        else:
+            if hasattr(submission, "post_hint") and submission.post_hint == "image":
+                return cls.IMAGE
+            elif hasattr(submission, "post_hint") and submission.post_hint == "hosted:video":
+                return cls.VIDEO
+            elif hasattr(submission, "is_gallery") and submission.is_gallery is True:
+                return cls.GALLERY
+            return cls.LINK
+
+    @classmethod
+    def type_is_self(cls, submission_type: "SubmissionType"):
+        return submission_type is cls.SELF or submission_type is cls.POLL
+
+    def is_self(self):
+        return SubmissionType.type_is_self(self)
+
+
+@dataclass(frozen=True)
+class PollOptionSnapshot:
+    __slots__ = ("text", "vote_count")
+    text: str
+    vote_count: Optional[int]  # Only known once the poll is closed
+
+
+@dataclass(frozen=True)
+class PollSnapshot:
+    __slots__ = ("total_vote_count", "voting_end_timestamp", "options")
+    total_vote_count: int
+    voting_end_timestamp: float  # Seconds since the epoch
+    options: Tuple[PollOptionSnapshot, ...]
+
+
+@dataclass(frozen=True)
+class VideoSnapshot:
+    __slots__ = ("duration", "dash_url", "fallback_url")
+    duration: int
+    dash_url: str
+    fallback_url: str
+
+
+@dataclass(frozen=True)
+class SubmissionSnapshot:
+    """
+    The parts of a submission used to render and upload it, taken once per fetch
+
+    Unlike a Submission, a snapshot holds no reference to the Reddit client or the JSON it was built from,
+    and round-trips through ``to_dict`` and ``from_dict`` for the shared store.
+    """
+    __slots__ = ("id", "submission_type", "title", "selftext", "permalink", "url", "shortlink", "subreddit",
+                 "author", "author_fullname", "created_utc", "over_18", "thumbnail", "score", "num_comments",
+                 "awards", "gallery_urls", "poll", "video")
+    id: str
+    submission_type: SubmissionType
+    title: str
+    selftext: str
+    permalink: str
+    url: str
+    shortlink: str
+    subreddit: str
+    author: Optional[str]  # None if deleted
+    author_fullname: Optional[str]
+    created_utc: float
+    over_18: bool
+    thumbnail: Optional[str]
+    score: int
+    num_comments: int
+    awards: str  # Rendered by tier
+    gallery_urls: Tuple[str, ...]
+    poll: Optional[PollSnapshot]
+    video: Optional[VideoSnapshot]
+
+    @classmethod
+    def from_submission(cls, submission: Submission) -> "SubmissionSnapshot":
+        submission_type = SubmissionType.get_submission_type(submission)
+        return cls(
+            id=submission.id,
+            submission_type=submission_type,
+            title=submission.title,
+            selftext=submission.selftext,
+            permalink=submission.permalink,
+            url=submission.url,
+            shortlink=submission.shortlink,
+            subreddit=str(submission.subreddit),
+            author=str(submission.author) if submission.author is not None else None,
+            author_fullname=getattr(submission, "author_fullname", None),
+            created_utc=submission.created_utc,
+            over_18=submission.over_18,
+            thumbnail=getattr(submission, "thumbnail", None),
+            score=submission.score,
+            num_comments=submission.num_comments,
+            awards=award_tiers.render(submission.all_awardings),
+            gallery_urls=_gallery_urls(submission) if submission_type is SubmissionType.GALLERY else (),
+            poll=_poll(submission) if submission_type is SubmissionType.POLL else None,
+            video=_video(submission) if submission_type is SubmissionType.VIDEO else None,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-serializable form of the snapshot"""
+        return {**asdict(self), "submission_type": self.submission_type.name}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SubmissionSnapshot":
+        return dacite.from_dict(cls, data, _DACITE_CONFIG)
+
+
+_DACITE_CONFIG = dacite.Config(type_hooks={SubmissionType: SubmissionType.__getitem__}, cast=[tuple])
+
+
+def _gallery_urls(submission: Submission) -> Tuple[str, ...]:
+    """Full size image urls of a gallery, in order, skipping images Reddit failed to process"""
+    media_metadata = getattr(submission, "media_metadata", None) or {}
+    items = (getattr(submission, "gallery_data", None) or {}).get("items", [])
+    # Get media id from gallery_data, then dig into media_metadata[id], then extract the id.png part of the url
+    return tuple(
+        f"https://i.redd.it{urlparse(media_metadata[item['media_id']]['s']['u']).path}"
+        for item in items if "s" in media_metadata.get(item["media_id"], {})
+    )
+
+
+def _poll(submission: Submission) -> PollSnapshot:
+    # noinspection PyUnresolvedReferences
+    poll_data = submission.poll_data
+    return PollSnapshot(
+        total_vote_count=poll_data.total_vote_count,
+        voting_end_timestamp=poll_data.voting_end_timestamp / 1000.0,
+        options=tuple(PollOptionSnapshot(text=option.text, vote_count=getattr(option, "vote_count", None))
+                      for option in poll_data.options),
+    )
+
+
+def _video(submission: Submission) -> Optional[VideoSnapshot]:
+    reddit_video = (getattr(submission, "media", None) or {}).get("reddit_video")
+    if reddit_video is None:
+        return None
+    return VideoSnapshot(duration=reddit_video["duration"], dash_url=reddit_video["dash_url"],
+                         fallback_url=reddit_video["fallback_url"])
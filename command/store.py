@@ -0,0 +1,7 @@
+from typing import Optional
+
+from config import config
+from util import SharedStore
+
+shared_store: Optional[SharedStore] = SharedStore(config.sharding.store) if config.sharding.store else None
+"""Store shared by every shard process, if one is configured"""
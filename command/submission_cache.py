@@ -0,0 +1,108 @@
+import asyncio
+import dataclasses
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+
+from util import SharedStore, TTLCache
+from .ratelimit import Priority, request_priority
+from .snapshot import SubmissionSnapshot
+from .url import RedditKey
+
+VOLATILE_FIELDS = ("score", "num_comments", "awards", "over_18", "poll")
+"""Snapshot fields that keep changing after a post is made"""
+
+
+@dataclass
+class _Entry:
+    submission: SubmissionSnapshot
+    refreshed: float  # time.monotonic()
+
+
+class SubmissionCache:
+    """
+    Keeps fetched submissions by post id
+
+    A submission is kept for ``ttl`` seconds, but its volatile fields (score, comments, awards, NSFW, poll)
+    are only fresh for ``volatile_ttl`` seconds. A stale submission is returned right away while
+    its volatile fields are refreshed in the background. A poll that was open when it was fetched
+    is fetched again once voting has ended, since Reddit only includes the results after that.
+    With a shared store, snapshots fetched or refreshed by other processes are used before asking Reddit.
+    """
+    def __init__(self, max_size: int, ttl: float, volatile_ttl: float, store: Optional[SharedStore] = None):
+        self.entries: TTLCache[RedditKey, _Entry] = TTLCache(max_size, ttl)
+        self.volatile_ttl = volatile_ttl
+        self.store = store
+        self.stale_hits = 0
+        self._refreshing: Dict[RedditKey, asyncio.Task] = {}  # Referenced until done, or they may be collected
+
+    async def get(self, key: RedditKey, fetch: Callable[[], Awaitable[SubmissionSnapshot]]) -> SubmissionSnapshot:
+        entry = self.entries.get(key)
+        if entry is None and self.store is not None:
+            entry = self._shared(key)
+        if entry is not None and self._poll_ended(entry):
+            entry = None
+        if entry is None:
+            submission = await fetch()
+            entry = _Entry(submission=submission, refreshed=time.monotonic())
+            self.entries.set(key, entry)
+            self._share(key, entry)
+            return submission
+        if time.monotonic() - entry.refreshed > self.volatile_ttl and key not in self._refreshing:
+            self.stale_hits += 1
+            task = asyncio.ensure_future(self._refresh(key, entry, fetch))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+        return entry.submission
+
+    @staticmethod
+    def _poll_ended(entry: _Entry) -> bool:
+        """Whether the entry is of a poll that was still open when it was fetched, but isn't anymore"""
+        poll = entry.submission.poll
+        if poll is None:
+            return False
+        now = time.time()
+        refreshed = now - (time.monotonic() - entry.refreshed)
+        return refreshed < poll.voting_end_timestamp <= now
+
+    def _shared(self, key: RedditKey) -> Optional[_Entry]:
+        """Entry of a submission from the shared store, added to the local cache"""
+        data = self.store.get("submission", key.id)
+        if data is None:
+            return None
+        try:
+            submission = SubmissionSnapshot.from_dict(data["submission"])
+        except Exception:  # Written by a different version of the bot
+            logging.getLogger(__name__).warning("Could not load submission %s from the shared store", key.id,
+                                                exc_info=True)
+            return None
+        # The store keeps wall clock times, the local cache monotonic ones
+        entry = _Entry(submission=submission, refreshed=time.monotonic() - (time.time() - data["refreshed"]))
+        self.entries.set(key, entry)
+        return entry
+
+    def _share(self, key: RedditKey, entry: _Entry):
+        if self.store is not None:
+            refreshed = time.time() - (time.monotonic() - entry.refreshed)
+            self.store.set("submission", key.id, {"submission": entry.submission.to_dict(), "refreshed": refreshed},
+                           self.entries.ttl)
+
+    async def _refresh(self, key: RedditKey, entry: _Entry, fetch: Callable[[], Awaitable[SubmissionSnapshot]]):
+        request_priority.set(Priority.BACKGROUND)
+        try:
+            fresh = await fetch()
+            entry.submission = dataclasses.replace(entry.submission,
+                                                   **{field: getattr(fresh, field) for field in VOLATILE_FIELDS})
+            entry.refreshed = time.monotonic()
+            self._share(key, entry)
+        except Exception:
+            logging.getLogger(__name__).warning("Could not refresh submission %s", key, exc_info=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.entries.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.entries.misses,
+            "entries": len(self.entries),
+        }
@@ -0,0 +1,100 @@
+import re
+from enum import Enum, auto
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from aiohttp import ClientError, ClientSession
+
+from util.error import CommandUseFailure
+
+
+class RedditLinkKind(Enum):
+    SUBMISSION = auto()
+    COMMENT = auto()
+    SHARE = auto()  # /r/<subreddit>/s/<token>, only Reddit knows where it leads
+
+
+class RedditKey(NamedTuple):
+    """What a Reddit URL points at, usable as a cache or deduplication key"""
+    kind: RedditLinkKind
+    id: str
+    submission_id: Optional[str] = None  # Set for comments
+
+    @property
+    def url(self) -> str:
+        if self.kind is RedditLinkKind.COMMENT:
+            return f"https://www.reddit.com/comments/{self.submission_id}/_/{self.id}/"
+        if self.kind is RedditLinkKind.SHARE:
+            return f"https://www.reddit.com/{self.id}"
+        return f"https://www.reddit.com/comments/{self.id}/"
+
+
+REDDIT_HOSTS = re.compile(r"^(?:(?:www|old|new|np|m|i|amp|sh)\.)?reddit\.com$")
+SHORT_HOSTS = re.compile(r"^(?:www\.)?redd\.it$")
+ID = re.compile(r"^[0-9a-z]{1,13}$")
+PATH = re.compile(
+    r"^/(?:(?:r|u|user)/[\w-]+/)?"
+    r"(?:"
+    r"comments/(?P<submission_id>[0-9a-z]+)(?:/(?:comment/(?P<new_comment_id>[0-9a-z]+)"
+    r"|[^/]*(?:/(?P<comment_id>[0-9a-z]+))?))?"
+    r"|(?:gallery|poll)/(?P<gallery_id>[0-9a-z]+)"
+    r"|(?P<share>r/[\w-]+/s/[0-9A-Za-z]+)"
+    r")/?$",
+    re.IGNORECASE,
+)
+
+
+def parse_reddit_url(url: str) -> RedditKey:
+    """
+    Works out what a Reddit URL points at without any network I/O
+
+    Accepts www/old/new/np/mobile hosts, redd.it short links, /gallery/ and /poll/ links,
+    submission and comment permalinks, and share links.
+
+    :raises util.error.CommandUseFailure: if the URL is not a Reddit post or comment link
+    """
+    url = url.strip().strip("<>")
+    if "://" not in url:
+        url = f"https://{url}"
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+    except ValueError:
+        raise CommandUseFailure("Invalid URL")
+    if parts.scheme not in ("http", "https"):
+        raise CommandUseFailure("Invalid URL")
+
+    if SHORT_HOSTS.match(host):
+        short_id = parts.path.strip("/").lower()
+        if ID.match(short_id):
+            return RedditKey(RedditLinkKind.SUBMISSION, short_id)
+        raise CommandUseFailure("Invalid URL")
+
+    if not REDDIT_HOSTS.match(host):
+        raise CommandUseFailure("Invalid URL")
+    match = PATH.match(parts.path)
+    if match is None:
+        raise CommandUseFailure("Invalid URL")
+    if match["share"]:
+        return RedditKey(RedditLinkKind.SHARE, match["share"])  # Share tokens are case sensitive
+    comment_id = match["new_comment_id"] or match["comment_id"]
+    if comment_id:
+        return RedditKey(RedditLinkKind.COMMENT, comment_id.lower(), match["submission_id"].lower())
+    return RedditKey(RedditLinkKind.SUBMISSION, (match["submission_id"] or match["gallery_id"]).lower())
+
+
+async def resolve_share_link(session: ClientSession, key: RedditKey) -> RedditKey:
+    """
+    Follows a share link to the post or comment it leads to
+
+    :raises util.error.CommandUseFailure: if it doesn't lead to a post or comment
+    """
+    try:
+        async with session.head(key.url, allow_redirects=True) as response:
+            resolved = str(response.url)
+    except ClientError:
+        raise CommandUseFailure("Invalid URL")
+    resolved_key = parse_reddit_url(resolved)
+    if resolved_key.kind is RedditLinkKind.SHARE:
+        raise CommandUseFailure("Invalid URL")
+    return resolved_key
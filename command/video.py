@@ -1,99 +1,705 @@
 import asyncio
+import io
+import logging
 import os
-import re
-from typing import Tuple, List, Callable, BinaryIO, Awaitable
+from asyncio.subprocess import DEVNULL, PIPE
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Tuple, List, Callable, BinaryIO, Awaitable, Optional, NamedTuple, AsyncIterator, Dict
 import xml.etree.ElementTree as xml_ET
 from urllib.parse import urljoin, urlparse
 
 import aiofiles
 import aiohttp
 import ffmpeg
-from aiohttp import ClientSession
-from asyncpraw.models import Submission
 
-from util import DiscordLimit, find, remove_file
+from config import config
+from util import DiscordLimit, SingleFlight, TTLCache, find, metrics, remove_file, stage
+from .snapshot import SubmissionSnapshot
 
 
-def get_urls_from_mpd(base_url: str, mpd_body: str) -> Tuple[str, List[str]]:
-    mpd: xml_ET.ElementTree = xml_ET.ElementTree(xml_ET.fromstring(mpd_body))
-    namespaces = {'': re.search("{(.*)}", mpd.getroot().tag)[1]}
-    reps = mpd.findall(".//Representation", namespaces)
-    try:
-        audio_path = find(reps, lambda e: e.get("id").lower().startswith("audio")).find("BaseURL", namespaces).text
-    except AttributeError:  # If there is no audio
-        audio_path = None
-    audio = urljoin(base_url, audio_path) if audio_path else None
-    videos = [
-        urljoin(base_url, e.find("BaseURL", namespaces).text)
-        for e in sorted(reps, key=lambda x: int(x.get("bandwidth")), reverse=True)
-        if e.get("id").lower().startswith("video")
-    ]
-    return audio, videos
+class Rendition(NamedTuple):
+    """One Representation of a DASH manifest"""
+    url: str
+    bandwidth: int  # bits per second
+    content_type: str = "video"
+    width: Optional[int] = None
+    height: Optional[int] = None
+    codecs: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Manifest:
+    """The renditions of a DASH manifest, each list from highest bandwidth to lowest"""
+    audio: List[Rendition]
+    videos: List[Rendition]
+
+
+def _content_type(attrib: Dict[str, str], default: Optional[str]) -> Optional[str]:
+    return attrib.get("contentType") or attrib.get("mimeType", "").partition("/")[0] or default
+
+
+def _int_or_none(value: Optional[str]) -> Optional[int]:
+    return int(value) if value else None
+
+
+def parse_mpd(base_url: str, mpd_body: str) -> Manifest:
+    """
+    Parses a DASH manifest in a single pass over its elements
+
+    Every AdaptationSet is read, so all audio tracks are kept, and BaseURLs are resolved
+    against the BaseURLs of their enclosing elements.
+    Representations without a content type are classified by their id, as older Reddit manifests need.
+    """
+    bases = [base_url]  # Resolved BaseURL of each enclosing element
+    has_base = [False]
+    content_types: List[Optional[str]] = [None]
+    renditions: Dict[str, List[Rendition]] = {"audio": [], "video": []}
+    for event, element in xml_ET.iterparse(io.StringIO(mpd_body), events=("start", "end")):
+        tag = element.tag.rpartition("}")[2]
+        if tag == "BaseURL":
+            if event == "end" and not has_base[-1]:
+                bases[-1] = urljoin(bases[-1], (element.text or "").strip())
+                has_base[-1] = True
+        elif tag in ("Period", "AdaptationSet", "Representation"):
+            if event == "start":
+                bases.append(bases[-1])
+                has_base.append(False)
+                content_types.append(_content_type(element.attrib, content_types[-1]))
+                continue
+            if tag == "Representation":
+                content_type = content_types[-1] \
+                               or ("audio" if element.get("id", "").lower().startswith("audio") else "video")
+                if content_type in renditions:
+                    renditions[content_type].append(Rendition(
+                        url=bases[-1],
+                        bandwidth=int(element.get("bandwidth", 0)),
+                        content_type=content_type,
+                        width=_int_or_none(element.get("width")),
+                        height=_int_or_none(element.get("height")),
+                        codecs=element.get("codecs"),
+                    ))
+            bases.pop()
+            has_base.pop()
+            content_types.pop()
+            element.clear()
+    for rendition_list in renditions.values():
+        rendition_list.sort(key=lambda rendition: rendition.bandwidth, reverse=True)
+    return Manifest(audio=renditions["audio"], videos=renditions["video"])
+
+
+def get_urls_from_mpd(base_url: str, mpd_body: str) -> Tuple[Optional[str], List[str]]:
+    """Returns the url of the best audio track, if there is one, and the video urls from highest bandwidth to lowest"""
+    manifest = parse_mpd(base_url, mpd_body)
+    return manifest.audio[0].url if manifest.audio else None, [video.url for video in manifest.videos]
+
+
+_manifests: TTLCache[str, Manifest] = TTLCache(config.video.manifest_cache_size, config.video.manifest_cache_ttl)
+
 
+async def fetch_manifest(bot, mpd_url: str) -> Manifest:
+    """Fetches and parses a DASH manifest, reusing recently parsed ones"""
+    manifest = _manifests.get(mpd_url)
+    if manifest is None:
+        async with _closing_unless_read(await bot.http_session.get(mpd_url, headers=bot.reddit_headers())) as r:
+            manifest = parse_mpd(mpd_url, await r.text())
+        _manifests.set(mpd_url, manifest)
+    return manifest
 
-async def get_video_approx_size(session: ClientSession, url: str):
+
+async def get_video_approx_size(bot, url: str):
     try:
-        async with session.head(url) as response:
+        async with bot.http_session.head(url, headers=bot.reddit_headers()) as response:
             return int(response.headers["Content-Length"])
     except:
         return 0
 
 
-async def do_reddit_video_download(bot, submission: Submission,
-                                   on_success: Callable[[BinaryIO], Awaitable[None]],
-                                   on_failure: Callable[[], Awaitable[None]]):
-    # noinspection PyProtectedMember
-    headers = {
-        "User-Agent": bot.config.user_agent,
-        "Authorization": f"Bearer {bot.reddit._core._authorizer.access_token}",
-    }
-    async with aiohttp.ClientSession(headers=headers) as session:
-        mpd_url = submission.media["reddit_video"]["dash_url"]
-        async with session.get(mpd_url) as r:
-            mpd_body = await r.text()
-        audio_url, video_urls = get_urls_from_mpd(mpd_url, mpd_body)
-        # noinspection PyProtectedMember
-        fallback_url = urlparse(submission.media["reddit_video"]["fallback_url"])._replace(query=None).geturl()
-        if fallback_url != video_urls[0]:
-            video_urls.insert(0, fallback_url)
-        for video_url in video_urls:
-            if await get_video_approx_size(session, video_url) > DiscordLimit.file_limit:
-                continue
+MUX_OVERHEAD = 1.02
+"""Muxed size relative to the sum of its tracks"""
+
+
+async def estimate_size(bot, rendition: Optional[Rendition], duration: float) -> Optional[int]:
+    """
+    Size of a rendition from a HEAD request, or from its bandwidth if the server doesn't say
+
+    :return: None if neither is known
+    """
+    if rendition is None:
+        return 0
+    size = await get_video_approx_size(bot, rendition.url)
+    if size > 0:
+        return size
+    return int(rendition.bandwidth * duration / 8) if rendition.bandwidth > 0 else None
+
+
+async def choose_renditions(bot, audio: Optional[Rendition], videos: List[Rendition],
+                            duration: float, limit: int) -> List[Rendition]:
+    """
+    Probes every rendition at once and returns the video renditions predicted to fit in the upload limit
+
+    The first one is the highest quality fit, the rest are only needed if that prediction turns out wrong.
+    Renditions of unknown size are left out.
+    """
+    audio_size, *video_sizes = await asyncio.gather(
+        estimate_size(bot, audio, duration),
+        *(estimate_size(bot, video, duration) for video in videos),
+    )
+    return [
+        video for video, video_size in zip(videos, video_sizes)
+        if video_size is not None and ((audio_size or 0) + video_size) * MUX_OVERHEAD <= limit
+    ]
+
+
+class VideoTooLarge(Exception):
+    """Raised when a video grows past the upload limit while it is being produced"""
+
+
+@asynccontextmanager
+async def ffmpeg_process(bot, stream, **kwargs):
+    """
+    Starts an ffmpeg-python stream as a subprocess, killing it on exit if it is still running
+
+    At most ``config.video.ffmpeg_workers`` processes run at once.
+    """
+    async with bot.ffmpeg_semaphore:
+        process = await asyncio.create_subprocess_exec(*stream.compile(), **kwargs)
+        try:
+            yield process
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+
+async def run_ffmpeg(bot, stream, timeout: Optional[float] = None) -> None:
+    """
+    Runs an ffmpeg-python stream in a subprocess without blocking the event loop
+
+    A process that outlives ``timeout`` (by default ``config.video.ffmpeg_timeout``),
+    or whose caller is cancelled, is killed.
+
+    :raises asyncio.TimeoutError
+    :raises ffmpeg.Error
+    """
+    timeout = bot.config.video.ffmpeg_timeout if timeout is None else timeout
+    async with ffmpeg_process(bot, stream, stdin=DEVNULL, stdout=DEVNULL, stderr=PIPE) as process:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    if process.returncode != 0:
+        raise ffmpeg.Error("ffmpeg", None, stderr)
+
+
+WRITE_BUFFER_SIZE = 1 << 20
+"""Downloaded chunks are coalesced into writes of about this many bytes"""
+
+
+async def iter_download(bot, url: str, max_bytes: int) -> AsyncIterator[bytes]:
+    """
+    Yields the body of a download in order as it arrives
+
+    If the server supports Range requests and the body is larger than ``config.video.range_size``,
+    the rest of the body is fetched in ranges over up to ``config.video.range_connections`` connections at once.
+    Each range, and the first request on server errors, is retried on its own up to ``config.video.range_retries``
+    times. Ranges are fetched at most ``range_connections`` ahead of the consumer,
+    so a slow consumer doesn't buffer the whole body.
+
+    :raises VideoTooLarge: as soon as the body is known to be larger than max_bytes
+    """
+    settings = bot.config.video
+    if settings.range_size <= 0:
+        async with _aclosing(_iter_whole(bot, url, max_bytes)) as downloads:
+            async for data in downloads:
+                yield data
+        return
+
+    tasks: List[asyncio.Task] = []
+    try:
+        headers = {**bot.reddit_headers(), "Range": f"bytes=0-{settings.range_size - 1}"}
+        attempt = 0
+        while True:
+            try:
+                resp = await bot.http_session.get(url, headers=headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= settings.range_retries:
+                    raise
+            else:
+                if resp.status < 500 or attempt >= settings.range_retries:
+                    break
+                resp.close()
+            await _retry_delay(attempt)
+            attempt += 1
+        async with _closing_unless_read(resp):
+            if resp.status != 206:  # The server ignored the range, so this is the whole body
+                async for data in _iter_body(resp, max_bytes):
+                    yield data
+                return
+            total = _range_total(resp)
+            if total is None:
+                resp.close()
+                async with _aclosing(_iter_whole(bot, url, max_bytes)) as downloads:
+                    async for data in downloads:
+                        yield data
+                return
+            if total > max_bytes:
+                raise VideoTooLarge()
+            ranges = [(start, min(start + settings.range_size, total) - 1)
+                      for start in range(settings.range_size, total, settings.range_size)]
+            tasks = [asyncio.ensure_future(_fetch_range(bot, url, *range_))
+                     for range_ in ranges[:settings.range_connections]]
+            received = 0
+            try:
+                async for data in resp.content.iter_any():
+                    received += len(data)
+                    yield data
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+        first_end = min(settings.range_size, total) - 1
+        if received <= first_end:  # The first response broke off, fetch what it didn't deliver
+            yield await _fetch_range(bot, url, received, first_end)
+        for index in range(len(ranges)):
+            if index + settings.range_connections < len(ranges):
+                tasks.append(asyncio.ensure_future(
+                    _fetch_range(bot, url, *ranges[index + settings.range_connections])))
+            yield await tasks[index]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _iter_whole(bot, url: str, max_bytes: int) -> AsyncIterator[bytes]:
+    async with _closing_unless_read(await bot.http_session.get(url, headers=bot.reddit_headers())) as resp:
+        async for data in _iter_body(resp, max_bytes):
+            yield data
+
+
+@asynccontextmanager
+async def _closing_unless_read(resp: aiohttp.ClientResponse) -> AsyncIterator[aiohttp.ClientResponse]:
+    """
+    Releases the connection of a response back to the pool, or closes it if the body wasn't read to the end
+
+    aiohttp puts a half-read connection back into the pool on release, where the next request on it hangs.
+    """
+    try:
+        yield resp
+    except BaseException:  # Including the consumer closing the download, or it being cancelled
+        resp.close()
+        raise
+    finally:
+        resp.release()
+
+
+@asynccontextmanager
+async def _aclosing(generator: AsyncIterator[bytes]) -> AsyncIterator[AsyncIterator[bytes]]:
+    """
+    Closes a download as soon as the consumer is done with it, even if it stops early
+
+    Otherwise its connection is only closed once the generator is garbage collected.
+    """
+    try:
+        yield generator
+    finally:
+        await generator.aclose()
+
+
+async def _iter_body(resp: aiohttp.ClientResponse, max_bytes: int) -> AsyncIterator[bytes]:
+    if resp.content_length is not None and resp.content_length > max_bytes:
+        raise VideoTooLarge()
+    received = 0
+    async for data in resp.content.iter_any():
+        received += len(data)
+        if received > max_bytes:
+            raise VideoTooLarge()
+        yield data
+
+
+def _range_total(resp: aiohttp.ClientResponse) -> Optional[int]:
+    """Full size of the body from the Content-Range of a partial response, None if the server doesn't say"""
+    _, _, total = resp.headers.get("Content-Range", "").rpartition("/")
+    return int(total) if total.isdigit() else None
+
+
+RANGE_RETRY_DELAY = 0.5
+"""Seconds before the first retry of a range, doubling with every retry"""
+
+_range_retries = metrics.counter("trm_download_range_retries_total", "Range requests retried after a failure")
+
+
+async def _retry_delay(attempt: int):
+    _range_retries.inc()
+    await asyncio.sleep(RANGE_RETRY_DELAY * 2 ** attempt)
+
+
+async def _fetch_range(bot, url: str, start: int, end: int) -> bytes:
+    """
+    Downloads the bytes from start to end inclusive, retrying on connection errors and short or invalid responses
+
+    :raises aiohttp.ClientError: once the retries are used up
+    :raises asyncio.TimeoutError: once the retries are used up
+    """
+    headers = {**bot.reddit_headers(), "Range": f"bytes={start}-{end}"}
+    attempt = 0
+    while True:
+        try:
+            async with _closing_unless_read(await bot.http_session.get(url, headers=headers)) as resp:
+                resp.raise_for_status()
+                if resp.status != 206:
+                    raise aiohttp.ClientPayloadError(f"Expected a partial response, got {resp.status}")
+                data = await resp.read()
+            if len(data) != end - start + 1:
+                raise aiohttp.ClientPayloadError(f"Expected {end - start + 1} bytes, got {len(data)}")
+            return data
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt >= bot.config.video.range_retries:
+                raise
+        await _retry_delay(attempt)
+        attempt += 1
+
+
+async def download_to_file(bot, url: str, filename: str, max_bytes: int):
+    """
+    Downloads to a file that is opened once, coalescing small chunks into large writes
+
+    :raises VideoTooLarge: as soon as more than max_bytes have been received
+    """
+    async with aiofiles.open(filename, "wb") as f, _aclosing(iter_download(bot, url, max_bytes)) as downloads:
+        buffer = bytearray()
+        async for data in downloads:
+            buffer += data
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                await f.write(buffer)
+                buffer = bytearray()
+        if buffer:
+            await f.write(buffer)
+
+
+async def feed_pipe(bot, url: str, pipe: BinaryIO, max_bytes: int):
+    """
+    Streams a download into a pipe, waiting whenever the reader falls behind
+
+    :raises VideoTooLarge: as soon as more than max_bytes have been received
+    """
+    loop = asyncio.get_event_loop()
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, pipe)
+    writer = asyncio.StreamWriter(transport, protocol, None, loop)
+    try:
+        async with _aclosing(iter_download(bot, url, max_bytes)) as downloads:
+            async for data in downloads:
+                writer.write(data)
+                await writer.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # ffmpeg stopped reading, its exit status tells us why
+    finally:
+        writer.close()
+
+
+async def gather_or_cancel(*aws: Awaitable) -> list:
+    """Like asyncio.gather, but cancels the remaining awaitables as soon as one fails"""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def mux_streaming(bot, video_url: str, audio_url: Optional[str], limit: int) -> Optional[bytes]:
+    """
+    Pipes the DASH tracks straight into ffmpeg and collects fragmented MP4 output in memory
+
+    Returns None as soon as the output grows past the upload limit.
+    The download and mux together must finish within ``config.video.ffmpeg_timeout``.
+
+    :raises asyncio.TimeoutError
+    :raises ffmpeg.Error
+    """
+    urls = [video_url, audio_url] if audio_url else [video_url]
+    pipes = [os.pipe() for _ in urls]
+    read_fds = [read_fd for read_fd, _ in pipes]
+    write_pipes = [os.fdopen(write_fd, "wb") for _, write_fd in pipes]
+    stream = ffmpeg.output(
+        *(ffmpeg.input(f"pipe:{read_fd}") for read_fd in read_fds),
+        "pipe:1",
+        format="mp4",
+        movflags="frag_keyframe+empty_moov",
+        strict="-2",
+        loglevel="error",
+    )
+    output = bytearray()
+
+    async def read_output(process):
+        while True:
+            data = await process.stdout.read(1 << 16)
+            if not data:
+                return
+            output.extend(data)
+            if len(output) > limit:
+                raise VideoTooLarge()
+
+    try:
+        async with ffmpeg_process(bot, stream, stdin=DEVNULL, stdout=PIPE, stderr=PIPE, pass_fds=read_fds) as process:
+            for read_fd in read_fds:
+                os.close(read_fd)
+            read_fds = []
+            stderr = asyncio.ensure_future(process.stderr.read())
             try:
-                audio_filename = f"@videos/audio_{submission.id}.mp4"
-                video_filename = f"@videos/video_{submission.id}.mp4"
-                filename = f"@videos/{submission.id}.mp4"
-                async def get_audio():
-                    async with session.get(audio_url) as resp:
-                        async for data in resp.content.iter_any():
-                            async with aiofiles.open(audio_filename, "ba") as f:
-                                await f.write(data)
-                async def get_video():
-                    async with session.get(video_url) as resp:
-                        async for data in resp.content.iter_any():
-                            async with aiofiles.open(video_filename, "ba") as f:
-                                await f.write(data)
+                await asyncio.wait_for(gather_or_cancel(
+                    *(feed_pipe(bot, url, pipe, limit) for url, pipe in zip(urls, write_pipes)),
+                    read_output(process),
+                    process.wait(),
+                ), timeout=bot.config.video.ffmpeg_timeout)
+            except VideoTooLarge:
+                return None
+            finally:
+                stderr.cancel()
+        if process.returncode != 0:
+            raise ffmpeg.Error("ffmpeg", None, stderr.result())
+        return bytes(output)
+    finally:
+        for read_fd in read_fds:
+            os.close(read_fd)
+        for pipe in write_pipes:
+            pipe.close()
+
+
+async def mux_files(bot, submission: SubmissionSnapshot, video_url: str, audio_url: Optional[str],
+                    limit: int) -> Optional[bytes]:
+    """
+    Downloads the DASH tracks to disk and muxes them into a file in ``@videos``
+
+    Returns None if the muxed file is over the upload limit.
+
+    :raises asyncio.TimeoutError
+    :raises ffmpeg.Error
+    """
+    # Jobs for the same submission with different limits may run at once
+    audio_filename = f"@videos/audio_{submission.id}_{limit}.mp4"
+    video_filename = f"@videos/video_{submission.id}_{limit}.mp4"
+    filename = f"@videos/{submission.id}_{limit}.mp4"
+    try:
+        try:
+            with stage("download", "video"):
                 if audio_url:
-                    await asyncio.gather(get_audio(), get_video())
+                    await gather_or_cancel(download_to_file(bot, audio_url, audio_filename, limit),
+                                           download_to_file(bot, video_url, video_filename, limit))
                 else:
-                    await get_video()
-                async def run_ffmpeg():
-                    inputs = [ffmpeg.input(video_filename), ffmpeg.input(audio_filename)] \
-                             if audio_url else [ffmpeg.input(video_filename)]
-                    ffmpeg.output(
-                        *inputs,
-                        filename,
-                        strict="-2",
-                        loglevel="quiet",
-                    ).run()
-                await run_ffmpeg()
-
-                with open(filename, "rb") as file:
-                    if os.path.getsize(file.name) <= DiscordLimit.file_limit:
-                        await on_success(file)
-                        return
-            finally:
-                remove_file(audio_filename)
-                remove_file(video_filename)
-                remove_file(filename)
-    await on_failure()
+                    await download_to_file(bot, video_url, video_filename, limit)
+        except VideoTooLarge:
+            return None
+        inputs = [ffmpeg.input(video_filename), ffmpeg.input(audio_filename)] \
+                 if audio_url else [ffmpeg.input(video_filename)]
+        with stage("mux", "video"):
+            await run_ffmpeg(bot, ffmpeg.output(
+                *inputs,
+                filename,
+                strict="-2",
+                loglevel="error",
+            ))
+
+        with open(filename, "rb") as file:
+            if os.path.getsize(file.name) <= limit:
+                return file.read()
+        return None
+    finally:
+        remove_file(audio_filename)
+        remove_file(video_filename)
+        remove_file(filename)
+
+
+UPLOAD_MARGIN = 0.95
+"""Share of a guild's upload limit used for the video, leaving room for the rest of the request"""
+
+
+def upload_limit(guild) -> int:
+    """
+    Largest video that can be uploaded to a guild
+
+    That is the default limit, or more if the guild's boosts allow it, up to ``config.video.max_upload_bytes``.
+    """
+    if guild is None:
+        return DiscordLimit.file_limit
+    return max(DiscordLimit.file_limit, min(int(guild.filesize_limit * UPLOAD_MARGIN), config.video.max_upload_bytes))
+
+
+CONTAINER_OVERHEAD = 0.96
+"""Share of the target size left for the audio and video streams when transcoding"""
+MIN_VIDEO_BITRATE = 100_000
+
+
+def transcode_bitrates(duration: float, limit: int, has_audio: bool, audio_bitrate: int) -> Optional[Tuple[int, int]]:
+    """
+    Video and audio bitrates in bits per second that make a video of this duration fit in the limit
+
+    Returns None if the video bitrate would be too low to be watchable.
+    """
+    total = int(limit * 8 * CONTAINER_OVERHEAD / max(duration, 1))
+    audio_bitrate = min(audio_bitrate, total // 4) if has_audio else 0
+    video_bitrate = total - audio_bitrate
+    return (video_bitrate, audio_bitrate) if video_bitrate >= MIN_VIDEO_BITRATE else None
+
+
+def transcode_threads(bot) -> int:
+    """Encoder threads per ffmpeg process, sharing the cores between the processes that may run at once"""
+    return max(1, (os.cpu_count() or 1) // max(1, bot.config.video.ffmpeg_workers))
+
+
+async def transcode_to_fit(bot, submission: SubmissionSnapshot, video: Rendition, audio_url: Optional[str],
+                           duration: float, limit: int) -> Optional[bytes]:
+    """
+    Re-encodes a Reddit video with libx264 at the bitrate that makes it fit in the limit
+
+    With ``config.video.transcode_two_pass``, the first pass measures the video so the second hits the size closely.
+    Returns None if the video would need too low a bitrate, or the result still doesn't fit.
+
+    :raises asyncio.TimeoutError
+    :raises ffmpeg.Error
+    """
+    settings = bot.config.video
+    bitrates = transcode_bitrates(duration, limit, audio_url is not None, settings.transcode_audio_bitrate)
+    if bitrates is None:
+        return None
+    video_bitrate, audio_bitrate = bitrates
+    audio_filename = f"@videos/transcode_audio_{submission.id}_{limit}.mp4"
+    video_filename = f"@videos/transcode_video_{submission.id}_{limit}.mp4"
+    passlog = f"@videos/transcode_{submission.id}_{limit}"
+    filename = f"@videos/transcode_{submission.id}_{limit}.mp4"
+    try:
+        try:
+            with stage("download", "video"):
+                if audio_url:
+                    await gather_or_cancel(
+                        download_to_file(bot, audio_url, audio_filename, settings.transcode_max_source_bytes),
+                        download_to_file(bot, video.url, video_filename, settings.transcode_max_source_bytes),
+                    )
+                else:
+                    await download_to_file(bot, video.url, video_filename, settings.transcode_max_source_bytes)
+        except VideoTooLarge:
+            return None
+        source = ffmpeg.input(video_filename)
+        video_stream = source.video
+        if video.height and video.height > settings.transcode_max_height:
+            video_stream = video_stream.filter("scale", -2, settings.transcode_max_height)
+        encoder = {"vcodec": "libx264", "preset": settings.transcode_preset, "threads": transcode_threads(bot),
+                   "b:v": video_bitrate, "maxrate": int(video_bitrate * 1.5), "bufsize": video_bitrate * 2,
+                   "movflags": "+faststart", "loglevel": "error"}
+        with stage("transcode", "video"):
+            if settings.transcode_two_pass:
+                first_pass = ffmpeg.output(video_stream, os.devnull, format="mp4", an=None,
+                                           passlogfile=passlog, **{"pass": 1}, **encoder)
+                await run_ffmpeg(bot, first_pass.overwrite_output(), settings.transcode_timeout)
+                encoder.update({"passlogfile": passlog, "pass": 2})
+            streams = [video_stream]
+            if audio_url:
+                streams.append(ffmpeg.input(audio_filename).audio)
+                encoder.update(acodec="aac", **{"b:a": audio_bitrate})
+            await run_ffmpeg(bot, ffmpeg.output(*streams, filename, **encoder).overwrite_output(),
+                             settings.transcode_timeout)
+
+        with open(filename, "rb") as file:
+            if os.path.getsize(file.name) <= limit:
+                return file.read()
+        return None
+    finally:
+        remove_file(audio_filename)
+        remove_file(video_filename)
+        remove_file(filename)
+        for suffix in ("-0.log", "-0.log.mbtree"):
+            remove_file(passlog + suffix)
+
+
+_video_flights = SingleFlight()
+
+
+async def download_reddit_video(bot, submission: SubmissionSnapshot,
+                                limit: int = DiscordLimit.file_limit) -> Optional[bytes]:
+    """
+    Downloads and muxes the best rendition of a Reddit video that fits in the upload limit
+
+    Concurrent downloads of the same submission and limit share one job.
+    With media workers configured, the job runs in a worker process unless none can be reached.
+    """
+    if bot.media_workers is not None:
+        return await _video_flights.do((submission.id, limit), lambda: _delegate_reddit_video(bot, submission, limit))
+    return await _video_flights.do((submission.id, limit), lambda: _download_and_cache(bot, submission, limit))
+
+
+async def _download_and_cache(bot, submission: SubmissionSnapshot, limit: int) -> Optional[bytes]:
+    async def on_result(rendition_url: str, data: bytes):
+        await bot.video_cache.put(submission.id, rendition_url, data)
+    return await download_reddit_video_here(bot, submission, limit, on_result)
+
+
+async def _delegate_reddit_video(bot, submission: SubmissionSnapshot, limit: int) -> Optional[bytes]:
+    try:
+        with stage("media_worker", "video"):
+            result = await bot.media_workers.download(submission, bot.reddit_headers(), limit)
+    except ConnectionError:
+        logging.getLogger(__name__).warning("No media worker available, downloading %s here", submission.id)
+        return await _download_and_cache(bot, submission, limit)
+    if result is None:
+        return None
+    data, rendition_url = result
+    await bot.video_cache.put(submission.id, rendition_url, data)
+    return data
+
+
+async def download_reddit_video_here(bot, submission: SubmissionSnapshot, limit: int,
+                                     on_result: Callable[[str, bytes], Awaitable[None]]) -> Optional[bytes]:
+    """
+    Downloads and muxes a Reddit video in this process, without going through the cache or media workers
+
+    ``on_result`` is called with the url of the rendition used and the muxed video before it is returned.
+    """
+    with stage("manifest", "video"):
+        manifest = await fetch_manifest(bot, submission.video.dash_url)
+    audio = manifest.audio[0] if manifest.audio else None
+    audio_url = audio.url if audio else None
+    videos = manifest.videos
+    # noinspection PyProtectedMember
+    fallback_url = urlparse(submission.video.fallback_url)._replace(query=None).geturl()
+    # A fallback missing from the manifest is estimated as large as the largest rendition in it
+    fallback = find(videos, lambda video: video.url == fallback_url,
+                    Rendition(fallback_url, max((video.bandwidth for video in videos), default=0)))
+    videos = [fallback, *(video for video in videos if video is not fallback)]
+    duration = submission.video.duration
+    try:
+        for video in await choose_renditions(bot, audio, videos, duration, limit):
+            if bot.config.video.streaming:
+                with stage("download_mux", "video"):
+                    data = await mux_streaming(bot, video.url, audio_url, limit)
+            else:
+                data = await mux_files(bot, submission, video.url, audio_url, limit)
+            if data is not None:
+                await on_result(video.url, data)
+                return data
+        if bot.config.video.transcode:
+            # Transcode from the best rendition that isn't much larger than what will come out
+            candidates = [video for video in videos if not video.height
+                          or video.height <= bot.config.video.transcode_max_height] or videos[-1:]
+            source = max(candidates, key=lambda video: video.bandwidth)
+            data = await transcode_to_fit(bot, submission, source, audio_url, duration, limit)
+            if data is not None:
+                await on_result(f"{source.url}#transcoded", data)
+                return data
+    except (asyncio.TimeoutError, ffmpeg.Error):
+        return None
+    return None
+
+
+async def do_reddit_video_download(bot, submission: SubmissionSnapshot,
+                                   on_success: Callable[[BinaryIO], Awaitable[None]],
+                                   on_failure: Callable[[str], Awaitable[None]],
+                                   limit: int = DiscordLimit.file_limit):
+    """Downloads a Reddit video, then hands it to on_success, or tells on_failure why it can't be uploaded"""
+    try:
+        data = await download_reddit_video(bot, submission, limit)
+    except Exception:
+        logging.getLogger(__name__).warning("Could not download video %s", submission.id, exc_info=True)
+        await on_failure("Video could not be downloaded")
+        return
+    if data is None:
+        await on_failure("Video too large to upload")
+        return
+    file = io.BytesIO(data)
+    file.name = f"{submission.id}.mp4"
+    await on_success(file)
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+from util import SharedStore, remove_file
+
+
+@dataclass
+class VideoCacheEntry:
+    key: str
+    submission_id: str
+    path: str
+    size: int
+    created: float
+
+
+class VideoCache:
+    """
+    On-disk cache of muxed videos, keyed by submission id and rendition url
+
+    Files are named ``<submission id>_<rendition hash>.mp4`` so the index can be rebuilt from the directory.
+    A submission can have several renditions cached, such as one transcoded to fit the default upload limit
+    and a larger one for a boosted guild.
+    Entries expire after ``ttl`` seconds, and the least recently used ones are evicted
+    once the cache holds more than ``max_bytes``.
+    With a shared store, processes sharing the directory also find the videos the others muxed.
+    """
+    FILENAME = re.compile(r"^(?P<submission_id>[0-9a-z]+)_(?P<digest>[0-9a-f]{16})\.mp4$")
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float, store: Optional[SharedStore] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+        self.entries: "OrderedDict[str, VideoCacheEntry]" = OrderedDict()  # Least recently used first
+        self.by_submission: Dict[str, Set[str]] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(submission_id: str, rendition_url: str) -> str:
+        return f"{submission_id}_{hashlib.sha256(rendition_url.encode()).hexdigest()[:16]}"
+
+    def _load(self):
+        found = []
+        for filename in os.listdir(self.directory):
+            match = self.FILENAME.match(filename)
+            if match is None:
+                continue
+            path = os.path.join(self.directory, filename)
+            stat = os.stat(path)
+            found.append(VideoCacheEntry(key=filename[:-len(".mp4")], submission_id=match["submission_id"],
+                                         path=path, size=stat.st_size, created=stat.st_mtime))
+        for entry in sorted(found, key=lambda e: e.created):
+            self._add(entry)
+        self._evict()
+
+    def _add(self, entry: VideoCacheEntry):
+        if entry.key in self.entries:
+            self._remove(entry.key, delete=False)
+        self.entries[entry.key] = entry
+        self.by_submission.setdefault(entry.submission_id, set()).add(entry.key)
+        self.total_bytes += entry.size
+
+    def _remove(self, key: str, delete: bool = True):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.size
+        keys = self.by_submission[entry.submission_id]
+        keys.discard(key)
+        if not keys:
+            del self.by_submission[entry.submission_id]
+        if delete:
+            remove_file(entry.path)
+            if self.store is not None:
+                renditions = [data for data in self._shared_renditions(entry.submission_id) if data["key"] != key]
+                self._share_renditions(entry.submission_id, renditions)
+
+    def _evict(self):
+        expiry = time.time() - self.ttl
+        for key in [key for key, entry in self.entries.items() if entry.created < expiry]:
+            self._remove(key)
+        while self.total_bytes > self.max_bytes and self.entries:
+            self._remove(next(iter(self.entries)))
+
+    def get(self, submission_id: str, max_size: Optional[int] = None) -> Optional[str]:
+        """Returns the path of the largest cached video for a submission that is no larger than ``max_size``"""
+        if not self.enabled:
+            return None
+        expiry = time.time() - self.ttl
+        for key in [key for key in self.by_submission.get(submission_id, ()) if self.entries[key].created < expiry]:
+            self._remove(key)
+        if self.store is not None:
+            self._shared(submission_id)
+        fitting = [self.entries[key] for key in self.by_submission.get(submission_id, ())
+                   if max_size is None or self.entries[key].size <= max_size]
+        if not fitting:
+            self.misses += 1
+            return None
+        entry = max(fitting, key=lambda e: e.size)
+        self.hits += 1
+        self.entries.move_to_end(entry.key)
+        return entry.path
+
+    def _shared(self, submission_id: str):
+        """Reconciles the local entries of a submission with the shared store"""
+        for key in list(self.by_submission.get(submission_id, ())):
+            if not os.path.exists(self.entries[key].path):
+                self._remove(key, delete=False)  # Evicted by another process
+        added = False
+        for data in self._shared_renditions(submission_id):
+            if data["key"] not in self.entries and os.path.exists(data["path"]):
+                self._add(VideoCacheEntry(submission_id=submission_id, **data))
+                added = True
+        if added:
+            self._evict()
+
+    def _shared_renditions(self, submission_id: str) -> List[dict]:
+        return (self.store.get("video", submission_id) or {}).get("renditions", [])
+
+    def _share_renditions(self, submission_id: str, renditions: List[dict]):
+        if renditions:
+            self.store.set("video", submission_id, {"renditions": renditions}, self.ttl)
+        else:
+            self.store.delete("video", submission_id)
+
+    async def put(self, submission_id: str, rendition_url: str, data: bytes) -> Optional[str]:
+        """Stores a muxed video and returns its path"""
+        if not self.enabled or len(data) > self.max_bytes:
+            return None
+        key = self.key(submission_id, rendition_url)
+        path = os.path.join(self.directory, f"{key}.mp4")
+        temp_path = f"{path}.part"
+        import aiofiles  # Only needed once a video is muxed, like the rest of the video stack
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                await f.write(data)
+            os.replace(temp_path, path)
+        finally:
+            remove_file(temp_path)
+        entry = VideoCacheEntry(key=key, submission_id=submission_id, path=path, size=len(data), created=time.time())
+        self._add(entry)
+        if self.store is not None:
+            renditions = [data for data in self._shared_renditions(submission_id) if data["key"] != key]
+            renditions.append({"key": key, "path": path, "size": entry.size, "created": entry.created})
+            self._share_renditions(submission_id, renditions)
+        self._evict()
+        return path
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+        }
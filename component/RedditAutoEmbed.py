@@ -0,0 +1,105 @@
+import asyncio
+import re
+from typing import List, Tuple
+
+import discord
+from discord.ext import commands
+
+from command.reddit import fetch_comment, fetch_submission, get_reddit_comment_embed, render_submission
+from command.url import RedditKey, RedditLinkKind, parse_reddit_url, resolve_share_link
+from util import *
+from util.error import CommandUseFailure
+from .MyCog import MyCog
+
+PREFILTER = "redd"
+"""Substring every Reddit link contains in lower case, checked before anything else"""
+
+LINK = re.compile(r"(?<!<)\bhttps?://(?:[\w-]+\.)?(?:reddit\.com|redd\.it)/[^\s<>|]+", re.IGNORECASE)
+"""Reddit links whose embed isn't suppressed with <>"""
+
+TRAILING = ".,;:!?)]}'\"*_~"
+"""Punctuation and markdown that ends a sentence rather than a link"""
+
+_auto_embeds = metrics.counter("trm_auto_embeds_total", "Links embedded from messages, by outcome", ("outcome",))
+
+
+def find_reddit_links(content: str, limit: int) -> List[RedditKey]:
+    """Returns up to ``limit`` distinct posts, comments and share links linked in a message"""
+    if PREFILTER not in content.lower():
+        return []
+    keys = []
+    for match in LINK.finditer(content):
+        try:
+            key = parse_reddit_url(match.group().rstrip(TRAILING))
+        except CommandUseFailure:
+            continue
+        if key not in keys:
+            keys.append(key)
+            if len(keys) >= limit:
+                break
+    return keys
+
+
+class RedditAutoEmbed(MyCog):
+    """
+    Embeds the Reddit posts and comments linked in messages
+
+    The same post is embedded at most once per channel every ``auto_embed.debounce`` seconds.
+    Links go through the same share link, cache and render pipeline as /reddit, but videos are not uploaded.
+    """
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.settings = self.bot.config.auto_embed
+        self.recent: TTLCache[Tuple[int, RedditKey], bool] = TTLCache(4096, self.settings.debounce)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.author.bot or message.guild is None:
+            return
+        if self.settings.guild_ids and message.guild.id not in self.settings.guild_ids:
+            return
+        keys = [key for key in find_reddit_links(message.content, self.settings.max_links)
+                if (message.channel.id, key) not in self.recent]
+        if not keys:
+            return
+        for key in keys:
+            self.recent.set((message.channel.id, key), True)
+        sent = await asyncio.gather(*(self.embed(message, key) for key in keys))
+        if self.settings.suppress_original and any(sent):
+            with Ignore(discord.Forbidden, discord.NotFound):
+                await message.edit(suppress=True)
+
+    async def embed(self, message: discord.Message, key: RedditKey) -> bool:
+        try:
+            if key.kind is RedditLinkKind.SHARE:
+                key = await resolve_share_link(self.bot.http_session, key)
+                if (message.channel.id, key) in self.recent:  # Also linked directly
+                    return False
+                self.recent.set((message.channel.id, key), True)
+            if key.kind is RedditLinkKind.COMMENT:
+                # The comment is checked against the NSFW status of its post
+                comment, submission = await asyncio.gather(
+                    fetch_comment(self.bot.reddit, key),
+                    fetch_submission(self.bot.reddit, RedditKey(RedditLinkKind.SUBMISSION, key.submission_id)))
+            else:
+                comment, submission = None, await fetch_submission(self.bot.reddit, key)
+        except Exception:
+            _auto_embeds.inc(outcome="not_found")
+            return False
+        if submission.over_18 and not message.channel.is_nsfw():
+            _auto_embeds.inc(outcome="nsfw")
+            return False
+        if comment is not None:
+            _, embed = await get_reddit_comment_embed(self.bot.reddit, comment)
+            submission_type = "comment"
+        else:
+            _, embeds = await render_submission(self.bot.reddit, submission)
+            embed, submission_type = embeds[0], submission.submission_type.name.lower()
+        try:
+            with stage("send", submission_type):
+                await message.channel.send(embed=embed, reference=message, mention_author=False)
+        except (discord.Forbidden, discord.NotFound):
+            _auto_embeds.inc(outcome="forbidden")
+            return False
+        _auto_embeds.inc(outcome="success")
+        return True
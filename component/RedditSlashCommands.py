@@ -1,16 +1,35 @@
+import asyncio
+from contextlib import contextmanager
+
 import discord
-from asyncpraw.reddit import Submission, Comment
+from asyncpraw.reddit import Comment
 from discord_slash import cog_ext, SlashContext, SlashCommandOptionType
 from discord_slash.model import SlashMessage
 from discord_slash.utils import manage_commands
 from discord_slash.utils.manage_commands import create_choice
 
-from command.video import do_reddit_video_download
+from command.snapshot import SubmissionSnapshot
+from command.url import RedditKey, RedditLinkKind, parse_reddit_url, resolve_share_link
 from util import *
 from util.error import CommandUseFailure
 from .MyCog import MyCog
-from command.reddit import SubmissionType, get_reddit_embed, get_reddit_poll_embed, get_reddit_gallery_embed, \
-    request_info_gallery, request_info_poll, get_reddit_video_embed, get_reddit_comment_embed
+from command.reddit import SubmissionType, fetch_submission, render_submission, request_info_gallery, \
+    request_info_poll, fetch_comment, get_reddit_comment_embed
+
+
+_commands = metrics.counter("trm_commands_total", "Commands handled, by outcome",
+                            ("command", "submission_type", "outcome"))
+
+
+@contextmanager
+def _cancel_on_error(task: asyncio.Task):
+    """Cancels a task started ahead of time if the code that was going to await it fails"""
+    try:
+        yield
+    except BaseException:
+        task.cancel()
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())  # Retrieved so it isn't logged
+        raise
 
 
 class RedditSlashCommands(MyCog):
@@ -58,44 +77,62 @@ class RedditSlashCommands(MyCog):
                        guild_ids=debug_guilds(),
                        )
     async def reddit(self, ctx: SlashContext, url: str, request_info: str = None):
-        # noinspection PyUnusedLocal
-        is_comment = False
-        with Ignore:
-            is_comment = bool(Comment.id_from_url(url))  # id is truthy
-        if is_comment:
-            await self.reddit_comment(ctx, url, request_info)
-        else:
-            await self.reddit_submission(ctx, url, request_info)
+        labels = {"command": "reddit", "submission_type": "unknown"}
+        try:
+            key = parse_reddit_url(url)
+            if key.kind is RedditLinkKind.SHARE:
+                with stage("defer"):
+                    await ctx.defer(hidden=request_info is not None)
+                with stage("resolve"):
+                    key = await resolve_share_link(self.bot.http_session, key)
+            if key.kind is RedditLinkKind.COMMENT:
+                labels["submission_type"] = "comment"
+                await self.reddit_comment(ctx, key, request_info)
+            else:
+                await self.reddit_submission(ctx, key, request_info, labels)
+        except CommandUseFailure:
+            _commands.inc(outcome="failure", **labels)
+            raise
+        except Exception:
+            _commands.inc(outcome="error", **labels)
+            raise
+        _commands.inc(outcome="success", **labels)
 
-    async def reddit_submission(self, ctx: SlashContext, url: str, request_info: str = None):
+    async def reddit_submission(self, ctx: SlashContext, key: RedditKey, request_info: str = None,
+                                labels: dict = None):
         hidden = request_info is not None
-        await ctx.defer(hidden=hidden)
+        fetch = asyncio.ensure_future(fetch_submission(self.bot.reddit, key))
+        if not ctx.deferred:
+            with stage("defer"), _cancel_on_error(fetch):
+                await ctx.defer(hidden=hidden)
         try:
-            submission: Submission = await self.bot.reddit.submission(url=url)
-            setattr(submission, "submission_type", SubmissionType.get_submission_type(submission))
+            with stage("fetch"):
+                submission: SubmissionSnapshot = await fetch
         except:
             raise CommandUseFailure("Invalid URL")
+        submission_type = submission.submission_type.name.lower()
+        if labels is not None:
+            labels["submission_type"] = submission_type
         if submission.over_18:
             if not ctx.channel.nsfw:
                 raise CommandUseFailure("NSFW submissions must be in an NSFW channel")
 
         embed = embeds = None
         do_video_upload = False
+        cached_video = None
         if request_info is None:
-            content, embed = await get_reddit_embed(self.bot.reddit, submission)
-            poll_embed = await get_reddit_poll_embed(self.bot.reddit, submission)
-            if poll_embed is not None:
-                embeds = [embed, poll_embed]
-                embed = None
-            gallery_embed = await get_reddit_gallery_embed(self.bot.reddit, submission)
-            if gallery_embed is not None:
-                embeds = [embed, gallery_embed]
-                embed = None
-            video_embed = await get_reddit_video_embed(self.bot.reddit, submission)
-            if video_embed is not None:
-                embeds = [embed, video_embed]
-                embed = None
-                do_video_upload = True
+            content, embeds = await render_submission(self.bot.reddit, submission)
+            if submission.submission_type is SubmissionType.VIDEO and submission.video is not None:
+                # The video stack (ffmpeg-python, the muxers) is only imported once a video is posted
+                from command.video import do_reddit_video_download, upload_limit
+                limit = upload_limit(ctx.guild)
+                cached_video = self.bot.video_cache.get(submission.id, limit)
+                if cached_video is None:
+                    do_video_upload = True
+                else:
+                    embeds = embeds[:1]
+            if len(embeds) == 1:
+                embed, embeds = embeds[0], None
         elif request_info == "link":
             if submission.submission_type.is_self():
                 raise CommandUseFailure("Post must be a link post")
@@ -115,26 +152,56 @@ class RedditSlashCommands(MyCog):
         else:
             raise CommandUseFailure("Invalid request_info string")
 
-        message: SlashMessage = await ctx.send(content=content, embed=embed, embeds=embeds, hidden=hidden)
+        with stage("send", submission_type):
+            message: SlashMessage = await ctx.send(content=content, embed=embed, embeds=embeds, hidden=hidden)
+
+        if cached_video is not None:
+            with stage("upload", submission_type):
+                await ctx.send(file=discord.File(fp=cached_video))
 
         if do_video_upload:
-            upload_message = await ctx.send("Attempting video upload... (this may take a while)")
+            upload_text = "Attempting video upload... (this may take a while)"
+            upload_message = await ctx.send(upload_text)
+            async def on_queue_position(position: int):
+                await upload_message.edit(
+                    content=f"{upload_text}\nPlace in queue: {position}" if position else upload_text)
             async def on_video_success(file):
                 await message.edit(content=content, embed=embeds[0])
-                await upload_message.edit(file=discord.File(fp=file))
+                with stage("upload", submission_type):
+                    await upload_message.edit(file=discord.File(fp=file))
                 await upload_message.edit(content=None)
-            async def on_video_failure():
-                embeds[1].set_footer(text="Video too large to upload")
+            async def on_video_failure(reason: str):
+                embeds[1].set_footer(text=reason)
                 await message._slash_edit(content=content, embeds=embeds)
                 await upload_message.delete()
-            await do_reddit_video_download(self.bot, submission, on_video_success, on_video_failure)
+            try:
+                job = self.bot.video_scheduler.submit(
+                    ctx.guild_id,
+                    lambda: do_reddit_video_download(self.bot, submission, on_video_success, on_video_failure,
+                                                     limit),
+                    on_queue_position,
+                )
+            except CommandUseFailure:
+                await upload_message.delete()
+                raise
+            try:
+                await job
+            except asyncio.CancelledError:
+                if not job.cancelled():  # This command is being cancelled, not the job
+                    raise
+                await on_video_failure("Video upload was cancelled")
 
-    async def reddit_comment(self, ctx: SlashContext, url: str, request_info: str = None):
-        await ctx.defer()
+    async def reddit_comment(self, ctx: SlashContext, key: RedditKey, request_info: str = None):
+        fetch = asyncio.ensure_future(fetch_comment(self.bot.reddit, key))
+        if not ctx.deferred:
+            with stage("defer"), _cancel_on_error(fetch):
+                await ctx.defer()
         try:
-            comment: Comment = await self.bot.reddit.comment(url=url)
-            await comment.refresh()
+            with stage("fetch", "comment"):
+                comment: Comment = await fetch
         except:
             raise CommandUseFailure("Invalid URL")
-        content, embed = await get_reddit_comment_embed(self.bot.reddit, comment)
-        await ctx.send(content=content, embed=embed)
+        with stage("embed", "comment"):
+            content, embed = await get_reddit_comment_embed(self.bot.reddit, comment)
+        with stage("send", "comment"):
+            await ctx.send(content=content, embed=embed)
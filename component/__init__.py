@@ -1,6 +1,10 @@
 from typing import List, Type
 
+from config import config
 from .MyCog import MyCog
 from .RedditSlashCommands import RedditSlashCommands
 
 cogs: List[Type[MyCog]] = [RedditSlashCommands]
+if config.auto_embed.enabled:
+    from .RedditAutoEmbed import RedditAutoEmbed
+    cogs.append(RedditAutoEmbed)
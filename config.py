@@ -1,6 +1,7 @@
 import json
+import os
 import re
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import yaml
 from dataclasses import dataclass, field
@@ -36,6 +37,133 @@ class Debug:
     guild_ids: List[int] = field(default_factory=list)
 
 
+@dataclass
+class RateLimit:
+    """Reddit API request pacing"""
+    rate: float = 1.0
+    burst: int = 10
+    reserve: int = 10
+
+
+@dataclass
+class Http:
+    """Connection pool settings for the shared media download session"""
+    limit: int = 100
+    limit_per_host: int = 8
+    dns_cache_ttl: int = 300
+    keepalive_timeout: float = 30.0
+
+
+@dataclass
+class Video:
+    """Video download and muxing settings"""
+    workers: int = 4
+    max_queued: int = 32
+    ffmpeg_workers: int = 2
+    ffmpeg_timeout: float = 120.0
+    streaming: bool = True
+    cache_dir: str = "@videos/cache"
+    cache_max_bytes: int = 1024 * 1024 * 1024
+    cache_ttl: float = 24 * 60 * 60
+    manifest_cache_size: int = 256
+    manifest_cache_ttl: float = 60 * 60
+    range_size: int = 1024 * 1024
+    range_connections: int = 4
+    range_retries: int = 3
+    max_upload_bytes: int = 8_000_000
+    transcode: bool = False
+    transcode_preset: str = "veryfast"
+    transcode_two_pass: bool = False
+    transcode_max_height: int = 720
+    transcode_audio_bitrate: int = 96_000
+    transcode_max_source_bytes: int = 200 * 1000 * 1000
+    transcode_timeout: float = 600.0
+
+
+@dataclass
+class MediaWorkers:
+    """Video download and muxing in separate worker processes"""
+    processes: int = 0
+    sockets: List[str] = field(default_factory=list)
+    socket_dir: str = "@videos/workers"
+    timeout: float = 300.0
+
+
+@dataclass
+class Authors:
+    """Redditor profile cache settings"""
+    max_size: int = 4096
+    ttl: float = 60 * 60
+    negative_ttl: float = 10 * 60
+    batch: bool = True
+
+
+@dataclass
+class Submissions:
+    """Submission cache settings"""
+    max_size: int = 2048
+    ttl: float = 6 * 60 * 60
+    volatile_ttl: float = 60
+
+
+@dataclass
+class AwardTier:
+    """An award tier, matched by award id or else by the lowest coin price it starts at"""
+    emoji: str
+    min_coin_price: int = 0
+    award_ids: List[str] = field(default_factory=list)
+
+
+def _default_award_tiers() -> List[AwardTier]:
+    return [
+        AwardTier(":medal:", 1800, ["gid_3"]),
+        AwardTier(":first_place:", 500, ["gid_2"]),
+        AwardTier(":second_place:", 100, ["gid_1"]),
+        AwardTier(":third_place:", 0),
+    ]
+
+
+@dataclass
+class Awards:
+    """Award tiers, in the order they are displayed"""
+    tiers: List[AwardTier] = field(default_factory=_default_award_tiers)
+
+
+@dataclass
+class AutoEmbed:
+    """Embedding of Reddit links posted in messages, off unless enabled"""
+    enabled: bool = False
+    guild_ids: List[int] = field(default_factory=list)
+    debounce: float = 60.0
+    max_links: int = 3
+    suppress_original: bool = False
+
+
+@dataclass
+class Sharding:
+    """Gateway sharding settings"""
+    enabled: bool = False
+    shard_count: Optional[int] = None
+    shard_ids: Optional[List[int]] = None
+    processes: int = 1
+    store: Optional[str] = None
+
+
+@dataclass
+class Commands:
+    """Slash command registration settings"""
+    sync: bool = True
+    hash_file: str = "@cache/commands.sha256"
+
+
+@dataclass
+class Metrics:
+    """Prometheus metrics endpoint settings"""
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 9108
+
+
 @dataclass
 class Config:
     """Bot settings and credentials"""
@@ -45,6 +173,17 @@ class Config:
     reddit: Reddit
     user_agent: str
     debug: Debug = Debug(enabled=False)
+    ratelimit: RateLimit = field(default_factory=RateLimit)
+    http: Http = field(default_factory=Http)
+    video: Video = field(default_factory=Video)
+    media_workers: MediaWorkers = field(default_factory=MediaWorkers)
+    authors: Authors = field(default_factory=Authors)
+    submissions: Submissions = field(default_factory=Submissions)
+    awards: Awards = field(default_factory=Awards)
+    auto_embed: AutoEmbed = field(default_factory=AutoEmbed)
+    sharding: Sharding = field(default_factory=Sharding)
+    commands: Commands = field(default_factory=Commands)
+    metrics: Metrics = field(default_factory=Metrics)
 
 
 def escape_keys(dct: Dict[str, Any]):
@@ -59,3 +198,5 @@ with open("versions.yaml", "r") as versions_yaml:
 with open("config.json", "r") as config_json:
     config: Config = dacite.from_dict(Config, json.load(config_json))
 config.reddit.user_agent = config.reddit.user_agent.format(version=versions.version)
+if os.environ.get("TRM_SHARD_IDS"):  # Set by main.py for each shard process
+    config.sharding.shard_ids = [int(shard_id) for shard_id in os.environ["TRM_SHARD_IDS"].split(",")]
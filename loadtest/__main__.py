@@ -0,0 +1,204 @@
+"""
+End-to-end load test of the /reddit command against local stand-ins for Reddit and Discord
+
+Run from the repository root (``config.json`` is loaded on import, like the bot)::
+
+    python -m loadtest --commands 500 --concurrency 100 --mix self=3,image=3,link=2,gallery=1,poll=1,comment=2
+    python -m loadtest --rate 50 --duration 30 --mix video=1 --media-dir /path/with/video.mp4/and/audio.mp4
+
+Commands run through RedditSlashCommands with a FakeSlashContext, a real MyBot and a FakeReddit server
+with configurable latency. Latency is measured from invocation until the command returns,
+including any video upload it waits for.
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from component.RedditSlashCommands import RedditSlashCommands
+from config import config
+from main import MyBot
+from util.error import CommandUseFailure
+from .fake_discord import FakeSlashContext
+from .fake_reddit import POST_TYPES, FakeReddit, comment_id, post_id
+
+
+@dataclasses.dataclass
+class Result:
+    kind: str
+    outcome: str
+    latency: float
+    first_send: Optional[float]
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in POST_TYPES and kind != "comment":
+            raise argparse.ArgumentTypeError(f"Unknown kind {kind!r}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class Driver:
+    def __init__(self, bot: MyBot, mix: Dict[str, float], posts: int, guilds: int):
+        self.cog = RedditSlashCommands(bot)
+        self.kinds = list(mix)
+        self.weights = list(mix.values())
+        self.posts = posts
+        self.guilds = guilds
+        self.results: List[Result] = []
+
+    def url(self, kind: str) -> str:
+        index = random.randrange(self.posts)
+        if kind == "comment":
+            return f"https://www.reddit.com/r/test/comments/{post_id('self', 0)}/_/{comment_id(index)}/"
+        return f"https://www.reddit.com/r/test/comments/{post_id(kind, index)}/"
+
+    async def invoke(self):
+        kind = random.choices(self.kinds, self.weights)[0]
+        ctx = FakeSlashContext(guild_id=random.randrange(self.guilds))
+        start = time.perf_counter()
+        try:
+            # noinspection PyUnresolvedReferences
+            await RedditSlashCommands.reddit.func(self.cog, ctx, url=self.url(kind))
+            outcome = "success"
+        except CommandUseFailure as e:
+            outcome = f"failure: {e.message}"
+        except Exception as e:
+            outcome = f"error: {type(e).__name__}"
+        self.results.append(Result(kind, outcome, time.perf_counter() - start, ctx.first("send")))
+
+    async def closed_loop(self, commands: int, concurrency: int):
+        """Keeps ``concurrency`` commands in flight until ``commands`` have run"""
+        remaining = iter(range(commands))
+
+        async def worker():
+            for _ in remaining:
+                await self.invoke()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def open_loop(self, rate: float, duration: float):
+        """Starts commands at ``rate`` per second (Poisson arrivals) for ``duration`` seconds"""
+        tasks = []
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            tasks.append(asyncio.ensure_future(self.invoke()))
+            await asyncio.sleep(random.expovariate(rate))
+        await asyncio.gather(*tasks)
+
+
+def summarize(results: List[Result], elapsed: float) -> dict:
+    def latencies(selected: List[Result]) -> dict:
+        values = [result.latency for result in selected]
+        sends = [result.first_send for result in selected if result.first_send is not None]
+        return {
+            "count": len(selected),
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": max(values, default=float("nan")),
+            "mean": statistics.mean(values) if values else float("nan"),
+            "first_send_p50": percentile(sends, 50),
+            "first_send_p99": percentile(sends, 99),
+        }
+    return {
+        "commands": len(results),
+        "elapsed": elapsed,
+        "commands_per_second": len(results) / elapsed if elapsed else float("nan"),
+        "latency": latencies(results),
+        "by_kind": {kind: latencies([r for r in results if r.kind == kind])
+                    for kind in sorted({result.kind for result in results})},
+        "outcomes": dict(Counter(result.outcome for result in results)),
+    }
+
+
+def print_summary(summary: dict, reddit_requests: Counter):
+    print(f"{summary['commands']} commands in {summary['elapsed']:.2f}s "
+          f"({summary['commands_per_second']:.1f} commands/s)")
+    print(f"{'kind':<10} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'send p50':>9} {'send p99':>9}")
+    for kind, stats in [("all", summary["latency"]), *summary["by_kind"].items()]:
+        print(f"{kind:<10} {stats['count']:>6} {stats['p50']:>8.3f} {stats['p90']:>8.3f} {stats['p99']:>8.3f} "
+              f"{stats['max']:>8.3f} {stats['first_send_p50']:>9.3f} {stats['first_send_p99']:>9.3f}")
+    for outcome, count in sorted(summary["outcomes"].items()):
+        print(f"  {count:>6} {outcome}")
+    print("Fake Reddit requests: " + ", ".join(f"{path}={count}" for path, count in sorted(reddit_requests.items())))
+
+
+async def run(args: argparse.Namespace) -> dict:
+    fake = FakeReddit(latency=args.latency, jitter=args.jitter, media_latency=args.media_latency,
+                      media_dir=args.media_dir, ratelimit_remaining=args.ratelimit_remaining)
+    base_url = await fake.start()
+    cache_dir = tempfile.mkdtemp(prefix="trm-loadtest-")
+    bot_config = dataclasses.replace(config, video=dataclasses.replace(config.video, cache_dir=cache_dir))
+    bot = MyBot(bot_config, oauth_url=base_url, reddit_url=base_url, check_for_updates=False)
+    driver = Driver(bot, parse_mix(args.mix), args.posts, args.guilds)
+    try:
+        start = time.perf_counter()
+        if args.rate:
+            await driver.open_loop(args.rate, args.duration)
+        else:
+            await driver.closed_loop(args.commands, args.concurrency)
+        elapsed = time.perf_counter() - start
+    finally:
+        await bot.video_scheduler.close()
+        await bot.reddit.close()
+        if bot._http_session is not None:
+            await bot._http_session.close()
+        await fake.close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    summary = summarize(driver.results, elapsed)
+    summary["reddit_requests"] = dict(fake.requests)
+    summary["reddit_limiter"] = bot.reddit_limiter.stats()
+    print_summary(summary, fake.requests)
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m loadtest", description="End-to-end /reddit load test")
+    parser.add_argument("--mix", default="self=3,image=3,link=2,gallery=1,poll=1,comment=2",
+                        help="comma separated kind=weight, kinds: " + ", ".join((*POST_TYPES, "comment")))
+    parser.add_argument("--commands", type=int, default=500, help="commands to run in closed loop mode")
+    parser.add_argument("--concurrency", type=int, default=100, help="commands in flight in closed loop mode")
+    parser.add_argument("--rate", type=float, help="commands per second, switches to open loop mode")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run in open loop mode")
+    parser.add_argument("--posts", type=int, default=50, help="distinct posts per kind, lower means more cache hits")
+    parser.add_argument("--guilds", type=int, default=10, help="distinct guilds commands come from")
+    parser.add_argument("--latency", type=float, default=0.05, help="Reddit API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="random extra latency in seconds")
+    parser.add_argument("--media-latency", type=float, default=0.05, help="v.redd.it latency in seconds")
+    parser.add_argument("--media-dir", help="directory with video.mp4 and audio.mp4 to serve as DASH tracks")
+    parser.add_argument("--ratelimit-remaining", type=int, default=100000,
+                        help="X-Ratelimit-Remaining reported by the fake API")
+    parser.add_argument("--seed", type=int, help="random seed for a reproducible traffic pattern")
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    loop = asyncio.get_event_loop()
+    summary = loop.run_until_complete(run(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(summary, file, indent=2)
+    return 1 if any(outcome.startswith("error") for outcome in summary["outcomes"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
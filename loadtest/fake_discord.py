@@ -0,0 +1,61 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+
+
+@dataclass
+class FakeChannel:
+    nsfw: bool = False
+
+
+class FakeMessage:
+    """Message returned by FakeSlashContext.send, recording what is done to it"""
+    def __init__(self, ctx: "FakeSlashContext", kwargs: dict):
+        self.ctx = ctx
+        self.kwargs = kwargs
+        self.deleted = False
+
+    async def edit(self, **kwargs):
+        self.ctx.record("edit", kwargs)
+
+    async def _slash_edit(self, **kwargs):
+        self.ctx.record("edit", kwargs)
+
+    async def delete(self):
+        self.deleted = True
+        self.ctx.record("delete", {})
+
+
+@dataclass
+class FakeSlashContext:
+    """
+    Stands in for discord_slash.SlashContext, recording defer, send and edit calls with their time
+
+    Times are seconds since the context was created.
+    """
+    guild_id: int
+    channel: FakeChannel = field(default_factory=FakeChannel)
+    deferred: bool = False
+    created: float = field(default_factory=time.perf_counter)
+    calls: List[Tuple[float, str, Any]] = field(default_factory=list)
+
+    @property
+    def guild(self) -> None:
+        """No guild is cached, like SlashContext without the guild intent, so the default upload limit applies"""
+        return None
+
+    def record(self, name: str, kwargs: dict):
+        self.calls.append((time.perf_counter() - self.created, name, kwargs))
+
+    def first(self, name: str) -> Optional[float]:
+        """Time of the first call with the given name"""
+        return next((at for at, call, _ in self.calls if call == name), None)
+
+    async def defer(self, hidden: bool = False):
+        self.deferred = True
+        self.record("defer", {"hidden": hidden})
+
+    async def send(self, content: str = "", **kwargs) -> FakeMessage:
+        kwargs["content"] = content
+        self.record("send", kwargs)
+        return FakeMessage(self, kwargs)
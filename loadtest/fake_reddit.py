@@ -0,0 +1,166 @@
+import asyncio
+import copy
+import json
+import os
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmark", "fixtures")
+POST_TYPES = ("self", "poll", "link", "image", "video", "gallery")
+
+
+def _load_json(*path: str) -> Dict[str, Any]:
+    with open(os.path.join(FIXTURES, *path), "r") as file:
+        return json.load(file)
+
+
+def _listing(*children: Dict[str, Any]) -> Dict[str, Any]:
+    return {"kind": "Listing",
+            "data": {"after": None, "before": None, "dist": len(children), "children": list(children)}}
+
+
+def post_id(post_type: str, index: int) -> str:
+    """Id of the index-th fake post of a type, e.g. ``lt2x0007`` for the 8th video"""
+    return f"lt{POST_TYPES.index(post_type)}x{index:04d}"
+
+
+def comment_id(index: int) -> str:
+    return f"lc{index:05d}"
+
+
+class FakeReddit:
+    """
+    Local stand-in for the Reddit API and v.redd.it
+
+    Posts are built from the benchmark fixtures: the post ``post_id(type, n)`` is the ``type`` fixture under a new id.
+    Comments ``comment_id(n)`` belong to the first self post. Every request waits ``latency`` seconds
+    (plus up to ``jitter``), media requests wait ``media_latency`` instead.
+    Media is served from ``media_dir`` (``video.mp4`` and ``audio.mp4``) if given, otherwise as filler bytes
+    that ffmpeg will reject.
+    """
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, media_latency: float = 0.05,
+                 media_dir: Optional[str] = None, filler_size: int = 256 * 1024,
+                 ratelimit_remaining: int = 100000, ratelimit_window: int = 600):
+        self.latency = latency
+        self.jitter = jitter
+        self.media_latency = media_latency
+        self.ratelimit_remaining = ratelimit_remaining
+        self.ratelimit_window = ratelimit_window
+        self.requests: Counter = Counter()
+        self.url = ""
+        self._posts = {post_type: _load_json("submissions", f"{post_type}.json") for post_type in POST_TYPES}
+        self._comment = _load_json("comment.json")
+        self._media: Dict[str, bytes] = {}
+        if media_dir is not None:
+            for name in ("video", "audio"):
+                with open(os.path.join(media_dir, f"{name}.mp4"), "rb") as file:
+                    self._media[name] = file.read()
+        else:
+            self._media = {name: b"\0" * filler_size for name in ("video", "audio")}
+        with open(os.path.join(FIXTURES, "mpd", "modern.mpd"), "r") as file:
+            self._mpd = file.read()
+        self._runner: Optional[web.AppRunner] = None
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_post("/api/v1/access_token", self.access_token)
+        app.router.add_get("/comments/{id}/", self.comments)
+        app.router.add_get("/comments/{id}/_/{comment_id}", self.comments)
+        app.router.add_get("/api/info/", self.info)
+        app.router.add_get("/api/user_data_by_account_ids", self.user_data)
+        app.router.add_get("/user/{name}/about/", self.about)
+        app.router.add_get("/v/{id}/DASHPlaylist.mpd", self.mpd)
+        app.router.add_get("/v/{id}/{file}", self.media)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts serving and returns the base url"""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        # noinspection PyProtectedMember
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        media = request.path.startswith("/v/")
+        self.requests["media" if media else request.path.split("/")[1] or "root"] += 1
+        await asyncio.sleep((self.media_latency if media else self.latency) + random.uniform(0, self.jitter))
+        response = await handler(request)
+        if not media:
+            reset = self.ratelimit_window - int(time.time()) % self.ratelimit_window
+            response.headers["X-Ratelimit-Remaining"] = str(self.ratelimit_remaining)
+            response.headers["X-Ratelimit-Used"] = "0"
+            response.headers["X-Ratelimit-Reset"] = str(reset)
+        return response
+
+    def post(self, id_: str) -> Optional[Dict[str, Any]]:
+        try:
+            post_type = POST_TYPES[int(id_[2])]
+        except (IndexError, ValueError):
+            return None
+        data = copy.deepcopy(self._posts[post_type])
+        data.update(id=id_, name=f"t3_{id_}", permalink=f"/r/test/comments/{id_}/load_test/")
+        if post_type == "video":
+            video = data["media"]["reddit_video"]
+            video["dash_url"] = f"{self.url}/v/{id_}/DASHPlaylist.mpd"
+            video["fallback_url"] = f"{self.url}/v/{id_}/DASH_1080.mp4?source=fallback"
+            data["url"] = f"{self.url}/v/{id_}"
+        return {"kind": "t3", "data": data}
+
+    def comment(self, id_: str) -> Dict[str, Any]:
+        data = copy.deepcopy(self._comment)
+        link_id = post_id("self", 0)
+        data.update(id=id_, name=f"t1_{id_}", link_id=f"t3_{link_id}", parent_id=f"t3_{link_id}",
+                    permalink=f"/r/test/comments/{link_id}/load_test/{id_}/")
+        return {"kind": "t1", "data": data}
+
+    async def access_token(self, _request: web.Request) -> web.Response:
+        return web.json_response({"access_token": "load-test", "token_type": "bearer", "expires_in": 86400,
+                                  "scope": "*"})
+
+    async def comments(self, request: web.Request) -> web.Response:
+        post = self.post(request.match_info["id"])
+        if post is None:
+            raise web.HTTPNotFound()
+        comments = [self.comment(request.match_info["comment_id"])] if "comment_id" in request.match_info else []
+        return web.json_response([_listing(post), _listing(*comments)])
+
+    async def info(self, request: web.Request) -> web.Response:
+        things = []
+        for fullname in request.query.get("id", "").split(","):
+            kind, _, id_ = fullname.partition("_")
+            thing = self.comment(id_) if kind == "t1" else self.post(id_) if kind == "t3" else None
+            if thing is not None:
+                things.append(thing)
+        return web.json_response(_listing(*things))
+
+    async def user_data(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            fullname: {"name": f"user_{fullname}", "profile_img": "https://styles.redditmedia.com/icon.png"}
+            for fullname in request.query.get("ids", "").split(",") if fullname
+        })
+
+    async def about(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        return web.json_response({"kind": "t2", "data": {
+            "name": name, "id": "loadtest", "icon_img": "https://styles.redditmedia.com/icon.png",
+        }})
+
+    async def mpd(self, _request: web.Request) -> web.Response:
+        return web.Response(text=self._mpd, content_type="application/dash+xml")
+
+    async def media(self, request: web.Request) -> web.Response:
+        name = "audio" if "AUDIO" in request.match_info["file"] else "video"
+        return web.Response(body=self._media[name], content_type="video/mp4")
@@ -1,27 +1,112 @@
-from asyncio import Lock
+import time
+_started = time.perf_counter()  # Before the other imports, which count towards startup time
+
+import atexit
+from asyncio import Semaphore
 from dataclasses import asdict
+import hashlib
+import json
+import logging
+import os
 import signal
-import time
+import subprocess
+import sys
+from typing import Dict, List, Optional, TYPE_CHECKING
 
+from aiohttp import ClientSession
 from asyncpraw import Reddit
 from discord import Status, Activity, ActivityType
-from discord.ext.commands import Bot, Context
+from discord.ext.commands import AutoShardedBot, Bot, Context
 from discord_slash import SlashCommand, SlashContext
 
+from command.author import author_cache
+from command.ratelimit import RedditRateLimiter
+from command.reddit import submission_cache
+from command.scheduler import VideoScheduler
+from command.store import shared_store
+from command.video_cache import VideoCache
 from component import cogs
 from config import config, Config
+from util import create_http_session, metrics, start_metrics_server
 from util.error import CommandUseFailure
 
+if TYPE_CHECKING:  # Imported once used, the metrics server and the video stack are optional
+    from aiohttp.web import AppRunner
+    from command.media_worker import MediaWorkerClient
 
-class MyBot(Bot):
-    def __init__(self, config_: Config):
+
+class MyBot(AutoShardedBot if config.sharding.enabled else Bot):
+    def __init__(self, config_: Config, **reddit_options):
         self.config: Config = config_
-        super().__init__(command_prefix=self.config.prefix, owner_id=self.config.owner, status=Status.online)
-        self.reddit: Reddit = Reddit(**asdict(self.config.reddit))
-        self.video_lock: Lock = Lock()
+        sharding = {}
+        if self.config.sharding.enabled:
+            sharding = {"shard_count": self.config.sharding.shard_count, "shard_ids": self.config.sharding.shard_ids}
+        super().__init__(command_prefix=self.config.prefix, owner_id=self.config.owner, status=Status.online,
+                         **sharding)
+        self.reddit: Reddit = Reddit(**asdict(self.config.reddit), **reddit_options)
+        self.reddit_limiter: RedditRateLimiter = RedditRateLimiter.install(self.reddit, self.config.ratelimit.rate,
+                                                                           self.config.ratelimit.burst,
+                                                                           self.config.ratelimit.reserve)
+        self.video_scheduler: VideoScheduler = VideoScheduler(self.config.video.workers, self.config.video.max_queued)
+        self.ffmpeg_semaphore: Semaphore = Semaphore(self.config.video.ffmpeg_workers)
+        self.video_cache: VideoCache = VideoCache(self.config.video.cache_dir,
+                                                  self.config.video.cache_max_bytes,
+                                                  self.config.video.cache_ttl,
+                                                  shared_store)
+        self._media_worker_processes: List[subprocess.Popen] = []
+        self.media_workers: Optional["MediaWorkerClient"] = None
+        sockets = list(self.config.media_workers.sockets)
+        if self.config.media_workers.processes > 0 or sockets:
+            # Imports the video stack, which is otherwise only imported once a video is posted
+            from command.media_worker import MediaWorkerClient, spawn_workers
+            if self.config.media_workers.processes > 0:
+                self._media_worker_processes, spawned = spawn_workers(self.config.media_workers.processes,
+                                                                      self.config.media_workers.socket_dir)
+                atexit.register(self._stop_media_workers)  # However the bot exits
+                sockets += spawned
+            self.media_workers = MediaWorkerClient(sockets, self.config.media_workers.timeout)
+        self.startup_times: Dict[str, float] = {}
+        self._http_session: Optional[ClientSession] = None
+        self._metrics_runner: Optional["AppRunner"] = None
+        self._register_metrics()
         self.loop.create_task(self.startup())
         self.remove_command("help")  # Remove help command
 
+    @property
+    def http_session(self) -> ClientSession:
+        """Pooled HTTP session for media downloads, created on first use and closed on terminate"""
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = create_http_session(self.config)
+        return self._http_session
+
+    def reddit_headers(self) -> Dict[str, str]:
+        """Authorization headers using the current Reddit access token"""
+        # noinspection PyProtectedMember
+        return {"Authorization": f"Bearer {self.reddit._core._authorizer.access_token}"}
+
+    def _register_metrics(self):
+        caches = {
+            "authors": author_cache.stats,
+            "submissions": submission_cache.stats,
+            "videos": self.video_cache.stats,
+            "manifests": _manifest_stats,
+        }
+        metrics.gauge("trm_cache", "Cache hits, misses and size", ("cache", "stat"), lambda: {
+            (cache, stat): value for cache, stats in caches.items() for stat, value in stats().items()
+        })
+        metrics.gauge("trm_reddit_ratelimit", "Reddit API pacing", ("stat",), lambda: {
+            (stat,): value for stat, value in self.reddit_limiter.stats().items()
+        })
+        metrics.gauge("trm_video_jobs", "Video jobs waiting and running", ("state",), lambda: {
+            ("queued",): self.video_scheduler.queued,
+            ("running",): self.video_scheduler.running,
+        })
+        metrics.gauge("trm_startup_seconds", "Seconds from process start until each startup phase", ("phase",),
+                      lambda: {(phase,): seconds for phase, seconds in self.startup_times.items()})
+
+    def mark_startup(self, phase: str):
+        self.startup_times[phase] = time.perf_counter() - _started
+
     def add_cogs(self):
         for cog in cogs:
             self.add_cog(cog(self))
@@ -35,22 +120,65 @@ class MyBot(Bot):
 
     async def startup(self):
         await self.wait_until_ready()
+        self.mark_startup("ready")
         self._signal()
+        if self.config.metrics.enabled and self._metrics_runner is None:
+            shard_ids = self.config.sharding.shard_ids
+            port = self.config.metrics.port + (shard_ids[0] if shard_ids else 0)  # One port per shard process
+            self._metrics_runner = await start_metrics_server(self.config.metrics.host, port)
         await self.change_presence(activity=Activity(type=ActivityType.watching, name="trm.help"))
         print('Logged in as')
         print(self.user.name)
         print(self.user.id)
         print("/u/" + (await self.reddit.user.me()).name)
+        print(f"Ready in {self.startup_times['ready']:.2f}s")
         print('------')
 
+    async def sync_commands(self, slash: SlashCommand):
+        """
+        Syncs the slash commands with Discord, unless they are unchanged since the last sync
+
+        The last synced commands are remembered as a hash in ``config.commands.hash_file``.
+        """
+        commands = await slash.to_dict()
+        definition = json.dumps({"application": self.user.id, "commands": commands}, sort_keys=True, default=str)
+        digest = hashlib.sha256(definition.encode()).hexdigest()
+        path = self.config.commands.hash_file
+        try:
+            with open(path, "r") as file:
+                synced = file.read().strip() == digest
+        except FileNotFoundError:
+            synced = False
+        if synced:
+            logging.getLogger(__name__).info("Slash commands unchanged, skipping sync")
+        else:
+            await slash.sync_all_commands()
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, "w") as file:
+                file.write(digest)
+        self.mark_startup("commands_synced")
+
     async def terminate(self):
         try:
             await self.change_presence(status=Status.offline)
         finally:
+            await self.video_scheduler.close()
+            await self.loop.run_in_executor(None, self._stop_media_workers)  # Waits for them to exit
+            if self._metrics_runner is not None:
+                await self._metrics_runner.cleanup()
             await self.reddit.close()
+            if self._http_session is not None:
+                await self._http_session.close()
             await self.close()
             time.sleep(1)
 
+    def _stop_media_workers(self):
+        if self._media_worker_processes:
+            from command.media_worker import stop_workers
+            stop_workers(self._media_worker_processes)
+
     # noinspection PyMethodMayBeStatic
     async def on_slash_command_error(self, ctx: SlashContext, ex: Exception):
         if isinstance(ex, CommandUseFailure):
@@ -59,10 +187,47 @@ class MyBot(Bot):
         raise ex
 
 
-client: MyBot = MyBot(config)
-slash = SlashCommand(client, sync_commands=True)
-client.add_cogs()
+def _manifest_stats() -> Dict[str, int]:
+    video = sys.modules.get("command.video")  # Not imported until the first video
+    if video is None:
+        return {"hits": 0, "misses": 0, "entries": 0}
+    # noinspection PyProtectedMember
+    manifests = video._manifests
+    return {"hits": manifests.hits, "misses": manifests.misses, "entries": len(manifests)}
 
 
-if __name__ == "__main__":
+def shard_ranges(shard_count: int, processes: int) -> List[List[int]]:
+    """Splits the shards into contiguous ranges, one per process"""
+    ranges = [list(range(shard_count * index // processes, shard_count * (index + 1) // processes))
+              for index in range(processes)]
+    return [shard_ids for shard_ids in ranges if shard_ids]
+
+
+def run_shard_processes() -> int:
+    """Runs one bot process per range of shards until they all exit, forwarding SIGTERM to them"""
+    if not config.sharding.shard_count:
+        raise ValueError("sharding.shard_count must be set to run shards in several processes")
+    processes = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                         env={**os.environ, "TRM_SHARD_IDS": ",".join(map(str, shard_ids))})
+        for shard_ids in shard_ranges(config.sharding.shard_count, config.sharding.processes)
+    ]
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    return max(process.wait() for process in processes)
+
+
+def main():
+    if config.sharding.enabled and config.sharding.processes > 1 and config.sharding.shard_ids is None:
+        sys.exit(run_shard_processes())
+    client: MyBot = MyBot(config)
+    slash = SlashCommand(client)
+    client.add_cogs()
+    client.mark_startup("loaded")
+    # Commands are synced once, by the process that runs shard 0
+    if config.commands.sync and (not config.sharding.shard_ids or 0 in config.sharding.shard_ids):
+        client.loop.create_task(client.sync_commands(slash))
     client.run(config.token)
+
+
+if __name__ == "__main__":
+    main()
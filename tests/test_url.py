@@ -0,0 +1,127 @@
+import unittest
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from aiohttp import ClientConnectionError
+
+from command.url import RedditKey, RedditLinkKind, parse_reddit_url, resolve_share_link
+from component.RedditAutoEmbed import find_reddit_links
+from util.error import CommandUseFailure
+
+
+def submission(id_: str) -> RedditKey:
+    return RedditKey(RedditLinkKind.SUBMISSION, id_)
+
+
+class ParseRedditUrlTest(unittest.TestCase):
+    def test_submissions(self):
+        for url in [
+            "https://www.reddit.com/r/pics/comments/abc123/some_title/",
+            "https://old.reddit.com/r/pics/comments/abc123/some_title",
+            "https://new.reddit.com/r/pics/comments/abc123/",
+            "https://m.reddit.com/comments/abc123",
+            "http://reddit.com/comments/abc123/?utm_source=share",
+            "reddit.com/r/pics/comments/abc123/some_title/",
+            "<https://www.reddit.com/r/pics/comments/abc123/some_title/>",
+            "https://www.reddit.com/gallery/abc123",
+            "https://www.reddit.com/poll/abc123",
+            "https://redd.it/abc123",
+            "https://Reddit.com/r/Pics/comments/ABC123/Some_Title/",
+            "HTTPS://REDD.IT/ABC123",
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(parse_reddit_url(url), submission("abc123"))
+
+    def test_comments(self):
+        comment = RedditKey(RedditLinkKind.COMMENT, "def456", "abc123")
+        for url in [
+            "https://www.reddit.com/r/pics/comments/abc123/some_title/def456/",
+            "https://www.reddit.com/r/pics/comments/abc123/comment/def456/",
+            "https://www.reddit.com/r/pics/comments/abc123/some_title/DEF456/?context=3",
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(parse_reddit_url(url), comment)
+        self.assertEqual(comment.url, "https://www.reddit.com/comments/abc123/_/def456/")
+
+    def test_share_links_keep_their_case(self):
+        key = parse_reddit_url("https://www.reddit.com/r/pics/s/AbC123xYz")
+        self.assertEqual(key, RedditKey(RedditLinkKind.SHARE, "r/pics/s/AbC123xYz"))
+        self.assertEqual(key.url, "https://www.reddit.com/r/pics/s/AbC123xYz")
+
+    def test_invalid(self):
+        for url in [
+            "https://example.com/r/pics/comments/abc123/",
+            "https://notreddit.com/comments/abc123/",
+            "ftp://reddit.com/comments/abc123/",
+            "https://www.reddit.com/r/pics/",
+            "https://www.reddit.com/user/someone/",
+            "https://redd.it/",
+            "https://redd.it/not-an-id",
+            "https://[::1",
+        ]:
+            with self.subTest(url=url), self.assertRaises(CommandUseFailure):
+                parse_reddit_url(url)
+
+
+class FindRedditLinksTest(unittest.TestCase):
+    def test_finds_every_kind_regardless_of_case(self):
+        content = ("see https://Reddit.com/r/a/comments/abc/x/ and https://REDD.IT/def "
+                   "https://www.reddit.com/r/a/comments/abc/x/c1d2/ https://www.reddit.com/r/pics/s/AbC123 "
+                   "and https://redd.it/abc again")
+        self.assertEqual(find_reddit_links(content, 10), [
+            submission("abc"),
+            submission("def"),
+            RedditKey(RedditLinkKind.COMMENT, "c1d2", "abc"),
+            RedditKey(RedditLinkKind.SHARE, "r/pics/s/AbC123"),
+        ])
+
+    def test_trailing_punctuation(self):
+        content = "(https://redd.it/abc), **https://www.reddit.com/r/a/comments/def/x/**. https://redd.it/ghi!"
+        self.assertEqual(find_reddit_links(content, 10), [submission("abc"), submission("def"), submission("ghi")])
+
+    def test_skips_suppressed_links_and_limits(self):
+        self.assertEqual(find_reddit_links("<https://redd.it/abc>", 10), [])
+        self.assertEqual(find_reddit_links("https://redd.it/abc https://redd.it/def", 1), [submission("abc")])
+        self.assertEqual(find_reddit_links("no links here", 10), [])
+
+
+class FakeSession:
+    """Answers HEAD requests with the url that following redirects would end at"""
+    def __init__(self, redirects):
+        self.redirects = redirects
+        self.requested = []
+
+    @asynccontextmanager
+    async def head(self, url: str, allow_redirects: bool = False):
+        self.requested.append(url)
+        target = self.redirects.get(url)
+        if target is None:
+            raise ClientConnectionError()
+        yield SimpleNamespace(url=target if allow_redirects else url)
+
+
+class ResolveShareLinkTest(unittest.IsolatedAsyncioTestCase):
+    SHARE = RedditKey(RedditLinkKind.SHARE, "r/pics/s/AbC123")
+
+    async def resolve(self, target):
+        session = FakeSession({self.SHARE.url: target} if target else {})
+        key = await resolve_share_link(session, self.SHARE)
+        self.assertEqual(session.requested, ["https://www.reddit.com/r/pics/s/AbC123"])
+        return key
+
+    async def test_post(self):
+        key = await self.resolve("https://www.reddit.com/r/pics/comments/abc123/some_title/?share_id=x")
+        self.assertEqual(key, submission("abc123"))
+
+    async def test_comment(self):
+        key = await self.resolve("https://www.reddit.com/r/pics/comments/abc123/comment/def456/")
+        self.assertEqual(key, RedditKey(RedditLinkKind.COMMENT, "def456", "abc123"))
+
+    async def test_invalid(self):
+        for target in ["https://www.reddit.com/r/pics/s/AbC123", "https://example.com/", None]:
+            with self.subTest(target=target), self.assertRaises(CommandUseFailure):
+                await self.resolve(target)
+
+
+if __name__ == "__main__":
+    unittest.main()
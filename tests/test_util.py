@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from util import SingleFlight, TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = TTLCache(2, 60)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("b", 0), 0)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(2, 60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_expires(self):
+        cache = TTLCache(10, 60)
+        with mock.patch("time.monotonic", return_value=1000.0):
+            cache.set("a", 1)
+            cache.set("b", 2, ttl=5)
+        with mock.patch("time.monotonic", return_value=1010.0):
+            self.assertEqual(cache.get("a"), 1)
+            self.assertNotIn("b", cache)
+            self.assertIsNone(cache.get("b"))
+        with mock.patch("time.monotonic", return_value=1060.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_disabled(self):
+        cache = TTLCache(0, 60)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+    def test_pop_and_clear(self):
+        cache = TTLCache(10, 60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.pop("a"), 1)
+        self.assertIsNone(cache.pop("a"))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    async def test_coalesces(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+        results = await asyncio.gather(*(flights.do("key", fetch) for _ in range(5)))
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertNotIn("key", flights)
+        self.assertEqual(await flights.do("key", fetch), "result")
+        self.assertEqual(len(calls), 2)
+
+    async def test_shares_errors(self):
+        flights = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+        results = await asyncio.gather(flights.do("key", fail), flights.do("key", fail), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertNotIn("key", flights)
+
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        flights = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "result"
+        first = asyncio.ensure_future(flights.do("key", fetch))
+        second = asyncio.ensure_future(flights.do("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, "result")
+        self.assertTrue(first.cancelled())
+
+
+if __name__ == "__main__":
+    unittest.main()
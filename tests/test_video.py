@@ -0,0 +1,131 @@
+import asyncio
+import dataclasses
+import os
+import unittest
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+from command.video import Rendition, VideoTooLarge, choose_renditions, get_urls_from_mpd, iter_download, parse_mpd
+from config import config
+
+BODY = bytes(range(256)) * 1024  # 256 KiB
+MPD_FIXTURES = os.path.join(os.path.dirname(__file__), os.pardir, "benchmark", "fixtures", "mpd")
+MPD_URL = "https://v.redd.it/abc/DASHPlaylist.mpd"
+
+
+def load_mpd(name: str) -> str:
+    with open(os.path.join(MPD_FIXTURES, f"{name}.mpd"), "r") as file:
+        return file.read()
+
+
+class ParseMpdTest(unittest.TestCase):
+    def test_modern(self):
+        manifest = parse_mpd(MPD_URL, load_mpd("modern"))
+        self.assertEqual([audio.url for audio in manifest.audio],
+                         ["https://v.redd.it/abc/DASH_AUDIO_128.mp4", "https://v.redd.it/abc/DASH_AUDIO_64.mp4"])
+        self.assertEqual([video.height for video in manifest.videos], [1080, 720, 480, 360, 240])
+        self.assertEqual(manifest.videos[0].url, "https://v.redd.it/abc/DASH_1080.mp4")
+        self.assertEqual(manifest.videos[0].bandwidth, 4715206)
+
+    def test_legacy(self):
+        """Older manifests have no content types, so audio is told apart by its Representation id"""
+        manifest = parse_mpd(MPD_URL, load_mpd("legacy"))
+        self.assertEqual([(audio.url, audio.content_type) for audio in manifest.audio],
+                         [("https://v.redd.it/abc/audio", "audio")])
+        self.assertEqual([video.url for video in manifest.videos],
+                         [f"https://v.redd.it/abc/DASH_{height}.mp4" for height in (1080, 720, 480, 360, 240)])
+
+    def test_nested_base_urls(self):
+        mpd = """<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011"><BaseURL>media/</BaseURL><Period>
+  <AdaptationSet contentType="video">
+    <Representation id="1" bandwidth="100" height="240"><BaseURL>low.mp4</BaseURL></Representation>
+    <Representation id="2" bandwidth="300" height="480"><BaseURL>/abs/high.mp4</BaseURL></Representation>
+  </AdaptationSet>
+  <AdaptationSet mimeType="audio/mp4">
+    <Representation id="3" bandwidth="50"><BaseURL>audio.mp4</BaseURL></Representation>
+  </AdaptationSet>
+  <AdaptationSet contentType="text"><Representation id="4" bandwidth="1"/></AdaptationSet>
+</Period></MPD>"""
+        manifest = parse_mpd(MPD_URL, mpd)
+        self.assertEqual([video.url for video in manifest.videos],
+                         ["https://v.redd.it/abs/high.mp4", "https://v.redd.it/abc/media/low.mp4"])
+        self.assertEqual(manifest.audio, [Rendition("https://v.redd.it/abc/media/audio.mp4", 50, "audio")])
+
+    def test_get_urls_from_mpd(self):
+        audio_url, video_urls = get_urls_from_mpd(MPD_URL, load_mpd("legacy"))
+        self.assertEqual(audio_url, "https://v.redd.it/abc/audio")
+        self.assertEqual(video_urls[0], "https://v.redd.it/abc/DASH_1080.mp4")
+
+
+class IterDownloadTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        app = web.Application()
+        app.router.add_get("/video.mp4", self._video)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/video.mp4"
+        # One connection, so a connection put back into the pool half read is reused right away
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=1))
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.runner.cleanup()
+
+    @staticmethod
+    async def _video(request: web.Request) -> web.Response:
+        return web.Response(body=BODY, content_type="video/mp4")
+
+    def _bot(self, range_size: int) -> SimpleNamespace:
+        return SimpleNamespace(config=dataclasses.replace(config, video=dataclasses.replace(config.video,
+                                                                                            range_size=range_size)),
+                               http_session=self.session,
+                               reddit_headers=lambda: {})
+
+    async def _download(self, bot) -> bytes:
+        return b"".join([data async for data in iter_download(bot, self.url, len(BODY))])
+
+    async def _abandon(self, bot):
+        downloads = iter_download(bot, self.url, len(BODY))
+        async for _ in downloads:
+            break
+        await downloads.aclose()
+
+    async def test_whole(self):
+        bot = self._bot(0)
+        self.assertEqual(await self._download(bot), BODY)
+
+    async def test_reuse_after_abandoning(self):
+        for range_size in (0, 64 * 1024):
+            with self.subTest(range_size=range_size):
+                bot = self._bot(range_size)
+                await self._abandon(bot)
+                self.assertEqual(await asyncio.wait_for(self._download(bot), 5), BODY)
+
+    async def test_too_large(self):
+        bot = self._bot(0)
+        with self.assertRaises(VideoTooLarge):
+            async for _ in iter_download(bot, self.url, len(BODY) - 1):
+                pass
+        self.assertEqual(await asyncio.wait_for(self._download(bot), 5), BODY)
+
+
+class ChooseRenditionsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_unknown_size_left_out(self):
+        session = aiohttp.ClientSession()
+        self.addAsyncCleanup(session.close)
+        bot = SimpleNamespace(http_session=session, reddit_headers=lambda: {})
+        audio = Rendition("http://127.0.0.1:1/audio.mp4", 128_000, "audio")
+        videos = [Rendition("http://127.0.0.1:1/fallback.mp4", 0),  # HEAD fails and no bandwidth
+                  Rendition("http://127.0.0.1:1/720.mp4", 4_000_000),
+                  Rendition("http://127.0.0.1:1/360.mp4", 1_000_000)]
+        self.assertEqual(await choose_renditions(bot, audio, videos, 10, 2_000_000), videos[2:])
+
+
+if __name__ == "__main__":
+    unittest.main()
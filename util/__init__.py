@@ -1,2 +1,7 @@
+from .cache import *
 from .constants import *
+from .http import *
+from .metrics import *
+from .singleflight import *
+from .store import *
 from .util import *
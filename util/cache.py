@@ -0,0 +1,57 @@
+__all__ = ["TTLCache"]
+
+import time
+import typing
+from collections import OrderedDict
+
+_K = typing.TypeVar('_K')
+_V = typing.TypeVar('_V')
+_D = typing.TypeVar('_D')
+
+
+class TTLCache(typing.Generic[_K, _V]):
+    """
+    Bounded LRU mapping whose entries expire after a time to live
+
+    Once ``max_size`` entries are held, the least recently used one is dropped to make room.
+    Each entry can override the default ``ttl``, e.g. for shorter-lived negative results.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[_K, typing.Tuple[float, _V]]" = OrderedDict()  # key -> (expiry, value)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: _K) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key: _K, default: _D = None) -> typing.Union[_V, _D]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: _K, value: _V, ttl: typing.Optional[float] = None):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: _K, default: _D = None) -> typing.Union[_V, _D]:
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,18 @@
+__all__ = ["create_http_session"]
+
+from aiohttp import ClientSession, TCPConnector
+
+from config import Config
+
+
+def create_http_session(config_: Config) -> ClientSession:
+    """Pooled HTTP session for media downloads, sized by the http settings"""
+    return ClientSession(
+        connector=TCPConnector(
+            limit=config_.http.limit,
+            limit_per_host=config_.http.limit_per_host,
+            ttl_dns_cache=config_.http.dns_cache_ttl,
+            keepalive_timeout=config_.http.keepalive_timeout,
+        ),
+        headers={"User-Agent": config_.user_agent},
+    )
@@ -0,0 +1,182 @@
+__all__ = ["Counter", "Gauge", "Histogram", "Registry", "metrics", "stage", "start_metrics_server"]
+
+import bisect
+import math
+import time
+import typing
+from contextlib import contextmanager
+
+_Labels = typing.Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(names: typing.Sequence[str], values: typing.Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: typing.Dict[str, str]) -> _Labels:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> typing.Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}",
+                          *self.samples()])
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: typing.Dict[_Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> typing.Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """Value read from a callback at scrape time, returning a mapping of label values to values"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str],
+                 callback: typing.Callable[[], typing.Mapping[_Labels, float]]):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self) -> typing.Iterator[str]:
+        for key, value in self.callback().items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                 buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: typing.Dict[_Labels, typing.List[int]] = {}
+        self._sums: typing.Dict[_Labels, float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def samples(self) -> typing.Iterator[str]:
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format"""
+    def __init__(self):
+        self._metrics: typing.Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()) -> Counter:
+        return typing.cast(Counter, self.register(Counter(name, documentation, labelnames)))
+
+    def histogram(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                  buckets: typing.Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return typing.cast(Histogram, self.register(Histogram(name, documentation, labelnames, buckets)))
+
+    def gauge(self, name: str, documentation: str, labelnames: typing.Sequence[str],
+              callback: typing.Callable[[], typing.Mapping[_Labels, float]]) -> Gauge:
+        return typing.cast(Gauge, self.register(Gauge(name, documentation, labelnames, callback)))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+metrics = Registry()
+
+_stage_seconds = metrics.histogram("trm_stage_seconds", "Time spent in each stage of a command",
+                                   ("stage", "submission_type"))
+_stage_errors = metrics.counter("trm_stage_errors_total", "Stages that raised an exception",
+                                ("stage", "submission_type"))
+
+
+@contextmanager
+def stage(name: str, submission_type: str = "unknown"):
+    """
+    Times a pipeline stage, counting it as an error if it raises
+
+    Usage:
+
+    .. code-block:: python
+        with stage("reddit_fetch"):
+            pass
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        _stage_errors.inc(stage=name, submission_type=submission_type)
+        raise
+    finally:
+        _stage_seconds.observe(time.perf_counter() - start, stage=name, submission_type=submission_type)
+
+
+async def start_metrics_server(host: str, port: int, registry: Registry = metrics):
+    """
+    Serves the registry at http://host:port/metrics
+
+    :return: The aiohttp runner, to be cleaned up on shutdown
+    """
+    from aiohttp import web
+
+    async def handle(_request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,40 @@
+__all__ = ["SingleFlight"]
+
+import asyncio
+import typing
+
+_T = typing.TypeVar('_T')
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one in-flight task
+
+    Every caller awaiting the same key gets the result, or the error, of the first call.
+    A caller being cancelled does not cancel the shared task.
+
+    Usage:
+
+    .. code-block:: python
+        flights = SingleFlight()
+        result = await flights.do(key, lambda: fetch(key))
+    """
+    def __init__(self):
+        self._flights: typing.Dict[typing.Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._flights
+
+    async def do(self, key: typing.Hashable, function: typing.Callable[[], typing.Awaitable[_T]]) -> _T:
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(function())
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: typing.Hashable, task: asyncio.Future):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved in case every caller was cancelled
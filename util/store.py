@@ -0,0 +1,83 @@
+__all__ = ["SharedStore"]
+
+import json
+import logging
+import os
+import sqlite3
+import time
+import typing
+
+_D = typing.TypeVar('_D')
+
+
+class SharedStore:
+    """
+    Key-value store with expiring entries in an SQLite file, shared by every bot process on a host
+
+    Values are stored as JSON under a namespace. Errors are logged and treated as a miss so that the store
+    never fails a command. Calls are made on the event loop, so by default they don't wait for the database
+    to stop being busy with another process, and the rare busy database is a miss as well.
+    """
+    def __init__(self, path: str, timeout: float = 0.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # Setting up at startup may wait for other processes doing the same
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL, "
+                         "PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+        self._db.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+        self.purge()
+
+    def get(self, namespace: str, key: str, default: _D = None) -> typing.Union[typing.Any, _D]:
+        try:
+            row = self._db.execute("SELECT value FROM entries WHERE namespace = ? AND key = ? AND expires > ?",
+                                   (namespace, key, time.time())).fetchone()
+        except sqlite3.Error as e:
+            _log_error(e, "Could not read %s/%s from %s", namespace, key, self.path)
+            return default
+        return default if row is None else json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: typing.Any, ttl: float):
+        try:
+            self._db.execute("INSERT OR REPLACE INTO entries (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                             (namespace, key, json.dumps(value), time.time() + ttl))
+        except sqlite3.Error as e:
+            _log_error(e, "Could not write %s/%s to %s", namespace, key, self.path)
+
+    def delete(self, namespace: str, key: str):
+        try:
+            self._db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error as e:
+            _log_error(e, "Could not delete %s/%s from %s", namespace, key, self.path)
+
+    def items(self, namespace: str) -> typing.List[typing.Tuple[str, typing.Any]]:
+        """Unexpired entries of a namespace"""
+        try:
+            rows = self._db.execute("SELECT key, value FROM entries WHERE namespace = ? AND expires > ?",
+                                    (namespace, time.time())).fetchall()
+        except sqlite3.Error as e:
+            _log_error(e, "Could not read %s from %s", namespace, self.path)
+            return []
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def purge(self):
+        """Deletes expired entries"""
+        try:
+            self._db.execute("DELETE FROM entries WHERE expires <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            _log_error(e, "Could not purge %s", self.path)
+
+    def close(self):
+        self._db.close()
+
+
+def _log_error(error: sqlite3.Error, message: str, *args):
+    if isinstance(error, sqlite3.OperationalError) and "locked" in str(error):  # Busy with another process
+        logging.getLogger(__name__).debug(message, *args)
+    else:
+        logging.getLogger(__name__).warning(message, *args, exc_info=error)